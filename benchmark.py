@@ -0,0 +1,249 @@
+import time
+import json
+import argparse
+import subprocess
+import tempfile
+import contextlib
+from common import *
+
+from board import Board, BoardBatch
+from model import CaptainModel, AgentModel, Hint
+from datasets import CombinedInitializer, ArrayInitializer, WordCollocationsInitializer, SentenceCollocationsInitializer, FastTextInitializer, WordAssociationInitializer, DoubleLinkInitializer
+from corpus import CorpusIndex
+from simulation import Simulation
+from players import Game
+from training import Trainer
+
+
+#return the time in seconds per call of fn, averaged over repeats
+def measure(fn, repeats = 1):
+    start = time.perf_counter()
+    for _ in range(repeats): fn()
+    return (time.perf_counter() - start) / repeats
+
+
+#compare the "score" and "topk" hint modes on the same random boards - check that they give the same hints, and report the speedup
+def benchmarkHintModes(initializer, board_count = 200, top_k = 5):
+    exact = CaptainModel(initializer, "score")
+    topk = CaptainModel(initializer, "topk", top_k=top_k)
+    boards = [Board.randomBoard(random.random() < 0.5) for _ in range(board_count)]
+    #reveal some cards, so that boards from later turns are measured as well
+    for b in boards:
+        for _ in range(random.randrange(8)): b.revealCardOfColor(random.choice([BLUE, RED]))
+    teams = [random.choice([BLUE, RED]) for _ in boards]
+    batch = BoardBatch.fromBoards(boards)
+
+    exact_hints, topk_hints = [], []
+    exact_time = measure(lambda: exact_hints.extend(exact.giveHint(t, b) for t, b in zip(teams, boards))) / board_count
+    topk_time = measure(lambda: topk_hints.extend(topk.giveHint(t, b) for t, b in zip(teams, boards))) / board_count
+    exact_batch_time = measure(lambda: exact.giveHints(teams, batch)) / board_count
+    topk_batch_time = measure(lambda: topk.giveHints(teams, batch)) / board_count
+
+    matching = sum((e.word_i, e.count) == (t.word_i, t.count) for e, t in zip(exact_hints, topk_hints))
+    print (f"Hints matching the exact mode: {matching}/{board_count}")
+    print (f"Single board - score: {exact_time*1000:.3f} ms, topk: {topk_time*1000:.3f} ms, speedup {exact_time/topk_time:.1f}x")
+    print (f"Batched - score: {exact_batch_time*1000:.3f} ms, topk: {topk_batch_time*1000:.3f} ms per board, speedup {exact_batch_time/topk_batch_time:.1f}x")
+
+#give hints with weights in lower precisions on the same random boards - report how many hints match the float64 ones, and the speedup
+#returns a dictionary of (dtype name, (seconds per board, fraction of hints matching float64)). Boards use the given context, the current one if None
+def benchmarkPrecision(initializer, board_count = 200, dtypes = (np.float32, np.float16), context : Context = None):
+    context = context if context is not None else Context.current()
+    boards = [Board.randomBoard(random.random() < 0.5, context) for _ in range(board_count)]
+    for b in boards:
+        for _ in range(random.randrange(8)): b.revealCardOfColor(random.choice([BLUE, RED]))
+    teams = [random.choice([BLUE, RED]) for _ in boards]
+    batch = BoardBatch.fromBoards(boards)
+
+    reference = CaptainModel(initializer, dtype=np.float64, dictionary=context.dictionary)
+    reference_hints = []
+    reference_time = measure(lambda: reference_hints.extend(reference.giveHints(teams, batch))) / board_count
+    print (f"float64: {reference_time*1000:.3f} ms per board")
+    results = {}
+    for dtype in dtypes:
+        model = CaptainModel(initializer, dtype=dtype, dictionary=context.dictionary)
+        hints = []
+        t = measure(lambda: hints.extend(model.giveHints(teams, batch))) / board_count
+        matching = sum((r.word_i, r.count) == (h.word_i, h.count) for r, h in zip(reference_hints, hints))
+        print (f"{np.dtype(dtype).name}: {t*1000:.3f} ms per board, speedup {reference_time/t:.1f}x, hints matching float64: {matching}/{board_count}")
+        results[np.dtype(dtype).name] = (t, matching / board_count)
+    return results
+
+
+
+
+#create synthetic input files in the directory - random words, a corpus of lemmas, fast text embeddings and word associations. Returns the language settings for them
+#board words are a random subset of all words, corpus word frequencies follow the zipf law like in a real language
+def createSyntheticLanguage(directory : str, word_count = 3000, board_word_count = 400, hint_word_count = 2000, sentence_count = 20000, embedding_size = 64):
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    def word(): return "".join(random.choice(letters) for _ in range(random.randint(4, 9)))
+    words = list(dict.fromkeys(word() for _ in range(word_count)))
+
+    settings = LanguageSettings(os.path.join(directory, "lemmas.txt"), os.path.join(directory, "embeddings.vec"), os.path.join(directory, "board_words.txt"), os.path.join(directory, "hint_words.txt"), "synthetic", hint_word_count)
+    utils.save_words(settings.board_words_file, random.sample(words, board_word_count))
+    #lemmas one per line, sentences end with "."
+    frequencies = 1 / np.arange(1, len(words) + 1)
+    lines = []
+    for _ in range(sentence_count):
+        lines += list(np.random.choice(words, random.randint(3, 15), p=frequencies / frequencies.sum())) + ["."]
+    with open(settings.corpora_file, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    #embeddings of all words and some words that are not in the dictionary
+    embedded = words + [word() + "x" for _ in range(len(words) // 2)]
+    with open(settings.fast_text_file, "w") as f:
+        f.write(f"{len(embedded)} {embedding_size}\n")
+        for w in embedded:
+            f.write(w + " " + " ".join(f"{x:.4f}" for x in np.random.randn(embedding_size)) + "\n")
+    with open(os.path.join(directory, "associations.txt"), "w") as f:
+        f.write("CUE, TARGET, NORMED?, #G, #P, FSG, BSG, MSG\n")
+        for _ in range(len(words) * 2):
+            f.write(f"{random.choice(words).upper()}, {random.choice(words).upper()}, YES, 150, 10, {random.random():.3f}, 0.01, {random.choice(['0.02', '', '0.1'])}\n")
+    return settings
+
+
+#change the working directory to a new temporary directory, which is deleted afterwards. All data/ files written by initializers go there
+@contextlib.contextmanager
+def temporaryWorkingDirectory():
+    previous = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            yield directory
+        finally:
+            os.chdir(previous)
+
+
+#min. fraction of hints given with float32 weights that must match the float64 ones in the suite. Only near-ties of hint scores can differ
+FLOAT32_MIN_MATCH = 0.98
+
+#measure all hot paths on a synthetic language and random weights, no datasets are needed. Returns a dictionary of (benchmark name, seconds per call)
+#raises a RuntimeError if too few float32 hints match the float64 ones
+def runSuite(seed = 0, board_count = 100):
+    random.seed(seed)
+    np.random.seed(seed)
+    results = {}
+    def record(name, seconds):
+        results[name] = seconds
+        print (f"{name:32} {seconds*1000:10.4f} ms", flush=True)
+
+    with temporaryWorkingDirectory() as directory:
+        settings = createSyntheticLanguage(directory)
+        context = Context(language_settings=settings)
+        dictionary = context.dictionary
+        #random weights, most of them zero like the real ones
+        weights = np.maximum(np.random.random(dictionary.weights_size) - 0.8, 0) / 0.2
+        initializer = ArrayInitializer(weights)
+
+        boards = [Board.randomBoard(random.random() < 0.5, context) for _ in range(board_count)]
+        for b in boards:
+            for _ in range(random.randrange(8)): b.revealCardOfColor(random.choice([BLUE, RED]))
+        teams = [random.choice([BLUE, RED]) for _ in boards]
+        batch = BoardBatch.fromBoards(boards)
+        hints = [Hint(random.randrange(dictionary.hint_word_count), 1, dictionary=dictionary) for _ in boards]
+        def each(fn): return lambda: [fn(i) for i in range(board_count)]
+
+        #board
+        record("board_init", measure(lambda: Board.randomBoard(True, context), board_count))
+        record("board_get_weights", measure(each(lambda i: boards[i].getWeights(weights)), 3) / board_count)
+        record("board_get_captain_weights", measure(each(lambda i: boards[i].getCaptainWeights(weights)), 3) / board_count)
+
+        #captain and agent models
+        for mode in CaptainModel.HINT_MODES:
+            captain = CaptainModel(initializer, mode, dictionary=dictionary, incremental=False)
+            record(f"captain_hint_{mode}", measure(each(lambda i: captain.giveHint(teams[i], boards[i]))) / board_count)
+            record(f"captain_hints_batch_{mode}", measure(lambda: captain.giveHints(teams, batch)) / board_count)
+        captain = CaptainModel(initializer, dictionary=dictionary)
+        #the first hint creates the incremental state, the measured one only uses it
+        for i in range(board_count): captain.giveHint(teams[i], boards[i])
+        record("captain_hint_incremental", measure(each(lambda i: captain.giveHint(teams[i], boards[i]))) / board_count)
+        captain = CaptainModel(initializer, "topk", dictionary=dictionary, incremental=False, candidate_hints=64)
+        record("captain_hint_candidates", measure(each(lambda i: captain.giveHint(teams[i], boards[i]))) / board_count)
+        agent = AgentModel(initializer, dictionary=dictionary)
+        record("agent_guess", measure(each(lambda i: agent.guess(boards[i], hints[i])), 10) / board_count)
+        record("agent_guess_batch", measure(lambda: agent.guess(batch, hints), 10) / board_count)
+
+        #whole game without any output - Game.playRound waits for input, simulation plays by the same rules
+        simulation = Simulation.create(Game.TEAM_AI_AI, Game.TEAM_AI_AI, initializer, context)
+        record("simulation_round", measure(simulation.playRound, 10))
+        trainer = Trainer(initializer, context, batch_size=board_count)
+        record("training_game", measure(trainer.trainBatch, 3) / board_count)
+
+        #initializers, on the synthetic corpus, embeddings and associations
+        record("corpus_index_build", measure(lambda: CorpusIndex.build(settings.corporaSentences(), os.path.join("data", "corpus_synthetic"))))
+        record("corpus_index_build_sharded", measure(lambda: CorpusIndex.buildSharded(settings, os.path.join("data", "corpus_synthetic"))))
+        CorpusIndex.load(settings)
+        #word and sentence collocations are counted in one pass, when the first of them is computed
+        record("compute_collocations", measure(lambda: (WordCollocationsInitializer().computeWeights(dictionary), SentenceCollocationsInitializer().computeWeights(dictionary))))
+        FastTextInitializer.loadEmbeddings(dictionary)
+        record("compute_fasttext", measure(lambda: FastTextInitializer(0.685).computeWeights(dictionary)))
+        associations = WordAssociationInitializer(associations_file=os.path.join(directory, "associations.txt"))
+        record("compute_word_associations", measure(lambda: associations.computeWeights(dictionary)))
+        basic = CombinedInitializer([WordCollocationsInitializer(), SentenceCollocationsInitializer(), FastTextInitializer(0.685), associations], [1, 0.5, 0.75, 1], "basic")
+        #weights of all combined initializers are computed and cached first, only the double link itself is measured
+        double_link = DoubleLinkInitializer(basic)
+        double_link.computeWeights(dictionary)
+        record("compute_double_link", measure(lambda: double_link.computeWeights(dictionary)))
+
+        #hints in float32 must (almost) always be the same as in float64, the suite fails otherwise. Measured last, so that the boards above do not change
+        precision = benchmarkPrecision(initializer, board_count, (np.float32,), context)
+        record("captain_hints_batch_float32", precision["float32"][0])
+        if precision["float32"][1] < FLOAT32_MIN_MATCH:
+            raise RuntimeError(f"Only {precision['float32'][1]:.1%} of float32 hints match the float64 ones, at least {FLOAT32_MIN_MATCH:.0%} are required")
+    return results
+
+
+#current git revision, with a "-dirty" suffix if there are uncommitted changes. None outside of a git repository
+def gitRevision():
+    try:
+        directory = os.path.dirname(os.path.abspath(__file__))
+        revision = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=directory, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=directory, capture_output=True, text=True, check=True).stdout.strip()
+        return revision + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+#load all stored results - a dictionary of (revision, results)
+def loadResults(fname : str):
+    if not utils.file_exists(fname): return {}
+    with open(fname) as f:
+        return json.load(f)
+
+#store results of the given revision, results of other revisions are kept
+def saveResults(fname : str, revision : str, results):
+    all_results = loadResults(fname)
+    all_results[revision] = {"time": time.strftime("%Y-%m-%d %H:%M:%S"), "results": results}
+    utils.atomic_write(fname, lambda f: json.dump(all_results, f, indent=2), "w")
+
+#print the time of each benchmark relative to the results of another revision. Benchmarks slower by more than the threshold are marked as regressions
+def compareResults(results, baseline, threshold = 0.1):
+    print (f"{'benchmark':32} {'baseline':>12} {'current':>12} {'ratio':>8}")
+    for name, seconds in results.items():
+        if name not in baseline: continue
+        ratio = seconds / baseline[name]
+        print (f"{name:32} {baseline[name]*1000:9.4f} ms {seconds*1000:9.4f} ms {ratio:7.2f}x" + ("  REGRESSION" if ratio > 1 + threshold else ""))
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the speed of all hot paths on synthetic data")
+    parser.add_argument("--results", default="benchmark_results.json", help="file with stored results of all revisions")
+    parser.add_argument("--compare", default=None, help="revision to compare the results with")
+    parser.add_argument("--datasets", action="store_true", help="also compare hint modes and precisions using the real datasets")
+    args = parser.parse_args()
+    results_fname = os.path.abspath(args.results)
+
+    #results are compared with those stored before this run, the compared revision can be the current one
+    stored = loadResults(results_fname)
+    results = runSuite()
+    revision = gitRevision() or "unknown"
+    saveResults(results_fname, revision, results)
+    print (f"Results saved as revision {revision} into {results_fname}")
+    if args.compare is not None:
+        if args.compare not in stored: print (f"No results stored for revision {args.compare}")
+        else: compareResults(results, stored[args.compare]["results"])
+
+    if args.datasets:
+        random.seed(0)
+        np.random.seed(0)
+        benchmarkHintModes(CombinedInitializer.DefaultInitializer())
+        benchmarkPrecision(CombinedInitializer.DefaultInitializer())
@@ -1,7 +1,6 @@
 from typing import List
 from common import *
 from renderer import colored
-from Levenshtein import distance as levenshtein_dist
 
 
 
@@ -15,22 +14,25 @@ class BoardCard:
     role : int
     #whether this card is flipped over
     hidden : bool
+    #context of the board this card is on
+    context : Context
 
-    def __init__(self, word_i : int, role : int, hidden : bool = True):
+    def __init__(self, word_i : int, role : int, hidden : bool = True, context : Context = None):
         self.word_i = word_i
         self.role = role
         self.hidden = hidden
+        self.context = context if context is not None else Context.current()
     
     #the word on this card, as string
     @property
     def word(self) -> str:
-        return dictionary.boardWord(self.word_i)
+        return self.context.dictionary.boardWord(self.word_i)
     
     #get a colored string padded to cell width, known_role = show roles even for hidden cards (e.g. when captain is choosing a hint)
     def getStr(self, known_role : bool):
         #the role to color with
         role = self.role if known_role or not self.hidden else UNKNOWN
-        return colored(f"{self.word : <{display_settings.cell_width}}", role, self.hidden)
+        return colored(f"{self.word : <{self.context.display_settings.cell_width}}", role, self.hidden)
     
     def __str__(self):
         return self.word
@@ -56,6 +58,12 @@ class CardScoring:
     def weights(self, blue_turn):
         return {BLUE:self.my_team if blue_turn else self.enemy_team, RED:self.enemy_team if blue_turn else self.my_team, ASSASSIN:self.assassin, NEUTRAL:self.neutral}
     
+    #the same weights as an array, which can be indexed by card roles directly. UNKNOWN cards have score 0
+    def table(self, blue_turn):
+        table = np.zeros(max(BLUE, RED, NEUTRAL, ASSASSIN) + 1)
+        for role, w in self.weights(blue_turn).items(): table[role] = w
+        return table
+    
     #default scoring - 1.0 for ally, -3.0 for enemy, -20.0 for assassin and -1.0 for neutral
     @staticmethod
     def Default():
@@ -64,8 +72,10 @@ class CardScoring:
 
 
 class Board:
-    #list of all cards, and their count
-    cards : List[BoardCard]
+    #word index (into dictionary board words), role and hidden flag for every card on the board
+    word_idx : np.ndarray
+    roles : np.ndarray
+    hidden : np.ndarray
     size : int
     
     #how many red/blue cards are still hidden
@@ -77,92 +87,109 @@ class Board:
     #mask of booleans, True means disabled hints (they were selected already, or they are too close to a word present on the board)
     disabled_hints : np.ndarray
     
-    def __init__(self, words : List[int], roles : List[int]):
-        self.cards = [BoardCard(w, r) for w, r in zip(words, roles)]
-        self.size = len(self.cards)
+    #settings and the dictionary this board uses
+    context : Context
+    
+    #objects notified about changes of the board - they have onReveal(card_i) and onDisableHint(hint_i) methods
+    listeners : list
+    
+    @Profiler.timed("board_create")
+    def __init__(self, words : List[int], roles : List[int], context : Context = None):
+        self.context = context if context is not None else Context.current()
+        self.word_idx = np.asarray(words, dtype=np.intp)
+        self.roles = np.asarray(roles, dtype=np.int8)
+        self.hidden = np.full(self.word_idx.shape, True)
+        self.size = len(self.word_idx)
         
         self.hidden_blue_count = self.countRoles(BLUE)
         self.hidden_red_count = self.countRoles(RED)
         
         self.assassin_selected = False
         
-        #mask of disabled hints
-        self.disabled_hints = np.full([dictionary.hint_word_count], False, dtype=np.bool8)
-        for c in self.cards:
-            for i, h in enumerate(dictionary.hint_words):
-                #if a word is too close to a card (card contains word, word contains card, or the relative levenshtein distance is smaller than 50%), disable it
-                if c.word in h or h in c.word or levenshtein_dist(c.word, h) / max(len(c.word), len(h)) <= 0.5:
-                    self.disabled_hints[i] = True
-                    continue
+        #mask of disabled hints - if a word is too close to a card (card contains word, word contains card, or the relative levenshtein distance is smaller than 50%), disable it. Uses exclusions precomputed by the dictionary
+        self.disabled_hints = self.context.dictionary.disabledHints(self.word_idx)
+        
+        self.listeners = []
+    
+    #list of all cards. Cards are created from the arrays above, changing them does not change the board
+    @property
+    def cards(self) -> List[BoardCard]:
+        return [self.getCard(i) for i in range(self.size)]
                             
     #count all cards of a given role
     def countRoles(self, role):
-        return sum(1 for c in self.cards if c.role == role)
+        return int(np.count_nonzero(self.roles == role))
     
-    #get weights for all hints and cards on board
-    def getCaptainWeights(self, weights, hidden_val = 0.0):
+    #get weights for all hints and cards on board. If hints is given, only weights of these hint indices are returned
+    def getCaptainWeights(self, weights, hidden_val = 0.0, hints = None):
         #return weights if card is hidden, else hidden val
-        weights = self.getWeights(weights, hidden_val)
+        weights = self.getWeights(weights, hidden_val, hints)
         #set all disabled hints as hidden
-        weights[:, self.disabled_hints] = hidden_val
+        weights[:, self.disabled_hints if hints is None else self.disabled_hints[hints]] = hidden_val
         return weights
     
-    def getWeights(self, weights, hidden_val = 0.0):
-        #return weights if card is hidden, else hidden val
-        return np.array([weights[c.word_i] if c.hidden else np.full([dictionary.hint_word_count], hidden_val) for c in self.cards])
+    def getWeights(self, weights, hidden_val = 0.0, hints = None):
+        #return weights if card is hidden, else hidden val. Fancy indexing creates a copy in the dtype of the weights, so it can be modified
+        ws = weights[self.word_idx] if hints is None else weights[self.word_idx[:, None], hints]
+        ws[~self.hidden] = hidden_val
+        return ws
     
     #get scores for all board cards, based on the team currently playing
     def getScores(self, team : int, scoring : CardScoring = CardScoring.Default()):
-        #get a dictionary of weights
-        ws = scoring.weights(team == BLUE)
-        #get a score for each card based on all the weights, then return it
-        return np.array([ws[c.role] for c in self.cards])
+        #get a score for each card by indexing the score table with card roles
+        return scoring.table(team == BLUE)[self.roles]
     
     #reveal a card at the given position
     def reveal(self, card_i : int):
-        if self.cards[card_i].hidden:
+        if self.hidden[card_i]:
             #reveal the card, update hidden counts based on type
-            self.cards[card_i].hidden = False
-            c = self.cards[card_i]
-            if c.role == BLUE: self.hidden_blue_count -= 1
-            if c.role == RED: self.hidden_red_count -= 1
-            if c.role == ASSASSIN: self.assassin_selected = True
+            self.hidden[card_i] = False
+            role = self.roles[card_i]
+            if role == BLUE: self.hidden_blue_count -= 1
+            if role == RED: self.hidden_red_count -= 1
+            if role == ASSASSIN: self.assassin_selected = True
+            for l in self.listeners: l.onReveal(card_i)
             #return the selected card
-            return c
+            return self.getCard(card_i)
         else:
             raise RuntimeError("This word cannot be guessed - it is already revealed") 
     
     #disable a given hint (called when a captain says this hint)
     def disableHint(self, hint_i : int):
-        self.disabled_hints[hint_i] = True
+        if not self.disabled_hints[hint_i]:
+            self.disabled_hints[hint_i] = True
+            for l in self.listeners: l.onDisableHint(hint_i)
     
-    #find the card with given word
+    #find the card with given word, raise ValueError if it is not on the board
     def findWord(self, word_i : int):
-        return next(i for i, c in enumerate(self.cards) if c.word_i == word_i)
+        i = np.flatnonzero(self.word_idx == word_i)
+        if len(i) == 0: raise ValueError("This word is not on the board")
+        return int(i[0])
     
     #return true if given word can be guessed (=it exists on board and it is not hidden)
     def canGuess(self, word_i : int):
         try:
             i = self.findWord(word_i)
-            return self.cards[i].hidden
+            return bool(self.hidden[i])
         except ValueError:
             return False
     
     #select a random card of the given team color and reveal it
     def revealCardOfColor(self, team : int):
         #get indices of all cards of matching color, choose one at random
-        c = random.choice([i for i, c in enumerate(self.cards) if c.hidden and c.role == team])
+        c = random.choice(np.flatnonzero(self.hidden & (self.roles == team)).tolist())
         #reveal it and return the card
         return self.reveal(c)
     
     #get a card at the given position    
     def getCard(self, card_i : int):
-        return self.cards[card_i]
+        return BoardCard(int(self.word_idx[card_i]), int(self.roles[card_i]), bool(self.hidden[card_i]), self.context)
     
     #create a new random board, given the starting team
     @staticmethod
-    def randomBoard(blue_starts : bool):
-        return Board(dictionary.randomBoardWords(), game_settings.randomRoles(blue_starts))
+    def randomBoard(blue_starts : bool, context : Context = None):
+        context = context if context is not None else Context.current()
+        return Board(context.dictionary.randomBoardWords(context.game_settings.card_count), context.game_settings.randomRoles(blue_starts), context)
 
     #true if either team has no hidden cards left or the assassin was revealed
     @property
@@ -178,6 +205,80 @@ class Board:
     @property
     def red_won(self):
         return self.hidden_red_count == 0
+
+
+
+#many boards of the same size, stored as (boards, cards) arrays. Weights for all boards can be gathered at once
+class BoardBatch:
+    #all arrays have the shape (batch size, board size), except disabled hints, which are (batch size, hint count)
+    word_idx : np.ndarray
+    roles : np.ndarray
+    hidden : np.ndarray
+    disabled_hints : np.ndarray
+    context : Context
+    
+    def __init__(self, words : np.ndarray, roles : np.ndarray, hidden : typing.Optional[np.ndarray] = None, disabled_hints : typing.Optional[np.ndarray] = None, context : Context = None):
+        self.context = context if context is not None else Context.current()
+        self.word_idx = np.asarray(words, dtype=np.intp)
+        self.roles = np.asarray(roles, dtype=np.int8)
+        self.hidden = np.full(self.word_idx.shape, True) if hidden is None else np.asarray(hidden, dtype=bool)
+        self.disabled_hints = np.stack([self.context.dictionary.disabledHints(w) for w in self.word_idx]) if disabled_hints is None else disabled_hints
+    
+    @property
+    def batch_size(self):
+        return self.word_idx.shape[0]
+    
+    @property
+    def size(self):
+        return self.word_idx.shape[1]
+    
+    #how many red/blue cards are still hidden on each board
+    @property
+    def hidden_blue_count(self):
+        return np.count_nonzero(self.hidden & (self.roles == BLUE), 1)
+    
+    @property
+    def hidden_red_count(self):
+        return np.count_nonzero(self.hidden & (self.roles == RED), 1)
+    
+    #get weights for all hints and cards on all boards, shape (batch size, board size, hint count). If out is given, the weights are gathered into it
+    def getCaptainWeights(self, weights, hidden_val = 0.0, out = None):
+        weights = self.getWeights(weights, hidden_val, out)
+        #only a few hints are disabled, so they are set by their (board, hint) pairs instead of masking the whole array
+        boards_i, hints_i = np.nonzero(self.disabled_hints)
+        weights[boards_i, :, hints_i] = hidden_val
+        return weights
+    
+    def getWeights(self, weights, hidden_val = 0.0, out = None):
+        #with mode="clip", take writes into out directly (the default mode gathers into a temporary copy first). All indices are valid, nothing is clipped
+        ws = weights[self.word_idx] if out is None else np.take(weights, self.word_idx, 0, out=out, mode="clip")
+        ws[~self.hidden] = hidden_val
+        return ws
+    
+    #get scores for all cards, teams is either one team for all boards or an array with one team for every board
+    def getScores(self, teams, scoring : CardScoring = CardScoring.Default()):
+        teams = np.broadcast_to(teams, [self.batch_size])
+        #one score table for every board, based on whose turn it is
+        tables = np.stack([scoring.table(True), scoring.table(False)])[np.where(teams == BLUE, 0, 1)]
+        return np.take_along_axis(tables, self.roles.astype(np.intp), 1)
+    
+    #return the given board from this batch as a separate Board (the arrays are copied)
+    def getBoard(self, board_i : int):
+        board = Board(self.word_idx[board_i], self.roles[board_i], self.context)
+        board.disabled_hints = self.disabled_hints[board_i].copy()
+        for c in np.flatnonzero(~self.hidden[board_i]): board.reveal(c)
+        return board
+    
+    #stack given boards into one batch, all of them must use the same context
+    @staticmethod
+    def fromBoards(boards : List[Board]):
+        return BoardBatch(np.stack([b.word_idx for b in boards]), np.stack([b.roles for b in boards]), np.stack([b.hidden for b in boards]), np.stack([b.disabled_hints for b in boards]), boards[0].context)
+    
+    #create a batch of random boards, blue_starts is an array with one value for every board
+    @staticmethod
+    def randomBoards(blue_starts, context : Context = None):
+        context = context if context is not None else Context.current()
+        return BoardBatch(np.stack([context.dictionary.randomBoardWords(context.game_settings.card_count) for _ in blue_starts]), np.stack([context.game_settings.randomRoles(b) for b in blue_starts]), context=context)
     
 
 
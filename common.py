@@ -1,56 +1,83 @@
 import numpy as np
+import scipy.sparse
+import typing
 import random
 import os
+import hashlib
+import tempfile
+import locale
+import multiprocessing
 from typing import Dict, List
+from Levenshtein import distance as levenshtein_dist
+from profiling import Profiler
 
 
 class utils:
-    #ask the user to confirm a given operation
     @staticmethod
-    def confirm(prompt : str):
-        while True:
-            x = input(prompt + " (y / n): ")
-            if x == 'y':
-                return True
-            if x == 'n':
-                return False
-            print ("Invalid character, try again")
-
-    #check whether fname exists, ask user to confirm op if it does. returns true if file should be saved
+    def file_exists(fname : str):
+        return os.path.exists(fname)
+    
+    #size and modification time of a file, None if it does not exist. Used to detect changed input files
     @staticmethod
-    def save_check(fname : str):
-        if utils.file_exists(fname):
-            if not utils.confirm(f"File {fname} exists, overwrite?"):
-                print ("Writing file declined, saving nothing")
-                return False
-        return True
+    def file_signature(fname : str):
+        if not utils.file_exists(fname): return None
+        stat = os.stat(fname)
+        return stat.st_size, stat.st_mtime_ns
     
+    #stable hash of any value with a deterministic repr (strings, numbers, tuples, lists, dicts)
     @staticmethod
-    def file_exists(fname : str):
-        return os.path.exists(fname)
+    def hash_value(value):
+        return hashlib.sha1(repr(value).encode("utf-8")).hexdigest()
+    
+    #write a file by calling write(f) on a temporary file in the same directory, then rename it to fname. Other processes never see a partially written file,
+    #and if more of them write the same file at once, one complete version wins
+    @staticmethod
+    def atomic_write(fname : str, write, mode = "wb"):
+        directory = os.path.dirname(fname) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_fname = tempfile.mkstemp(dir=directory, prefix=os.path.basename(fname) + ".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, mode) as f:
+                write(f)
+            os.replace(tmp_fname, fname)
+        except BaseException:
+            os.remove(tmp_fname)
+            raise
     
     #load space-separated words from a given file
     @staticmethod
     def load_words(fname : str):
         return open(fname).read().lower().split(" ")
 
-    #save space-separated words into a given file. Ask if file exists.
+    #save space-separated words into a given file. Existing file is replaced
     @staticmethod
     def save_words(fname : str, words : List[str]):
-        if utils.save_check(fname):
-            with open(fname, "w") as f:
-                f.write(" ".join(words))
+        utils.atomic_write(fname, lambda f: f.write(" ".join(words)), "w")
 
-    #load numpy array from a given file
+    #load numpy array from a given file. .npz files contain sparse matrices. Dense arrays can be memory mapped using mmap_mode
     @staticmethod
-    def load_weights(fname : str):
-        return np.load(fname)
+    def load_weights(fname : str, mmap_mode = None):
+        return scipy.sparse.load_npz(fname).tocsr() if fname.endswith(".npz") else np.load(fname, mmap_mode=mmap_mode)
     
-    #save numpy array to a given file. Ask if file exists
+    #save numpy array or a sparse matrix to a given file. Existing file is replaced
     @staticmethod
     def save_weights(fname : str, weights : np.ndarray):
-        if utils.save_check(fname):
-            np.save(fname, weights)
+        if scipy.sparse.issparse(weights): utils.atomic_write(fname, lambda f: scipy.sparse.save_npz(f, weights))
+        else: utils.atomic_write(fname, lambda f: np.save(f, weights))
+    
+    #return weights as a dense numpy array, convert them if they are sparse
+    @staticmethod
+    def dense(weights):
+        return weights.toarray() if scipy.sparse.issparse(weights) else weights
+    
+    #list of fn(task) for all tasks, computed in a pool of processes (all cpus by default). Computed in this process if there is just one process or task,
+    #or if this is a daemon process (e.g. a pool worker), which cannot start a pool of its own
+    @staticmethod
+    def parallel_map(fn, tasks, processes : typing.Optional[int] = None):
+        processes = min(processes or os.cpu_count(), len(tasks))
+        if processes <= 1 or multiprocessing.current_process().daemon: return [fn(t) for t in tasks]
+        with multiprocessing.Pool(processes) as pool:
+            return pool.map(fn, tasks)
         
 
 
@@ -78,7 +105,16 @@ class Dictionary:
     #dictionary name (for file saving)
     name : str
     
-    def __init__(self, board_words : List[str], hint_words : List[str], name : str):
+    #settings of the language the words come from (corpora and embedding files used to compute weights)
+    language_settings : "LanguageSettings"
+    
+    #hash of all board and hint words, used in cache keys. Use the content_hash property to access it
+    _content_hash : typing.Optional[str]
+    
+    #packed bitmask of size (board words, ceil(hint words / 8)), bit (b, h) is set when hint h is too close to board word b. Use the hint_exclusions property to access it
+    _hint_exclusions : typing.Optional[np.ndarray]
+    
+    def __init__(self, board_words : List[str], hint_words : List[str], name : str, language_settings : "LanguageSettings" = None):
         self.weights_size = [len(board_words), len(hint_words)]
         
         #create a dictionary as an inverse to the given list
@@ -94,11 +130,50 @@ class Dictionary:
         self.max_board_word_length = max(len(w) for w in board_words)
         
         self.name = name
+        self.language_settings = language_settings if language_settings is not None else LanguageSettings.English()
+        
+        #hint exclusions are only computed when first needed - dictionaries created just for computing weights never need them
+        self._hint_exclusions = None
+        self._content_hash = None
+    
+    #load based on language settings. Exclusions are loaded right away, so that creating boards is fast later
+    @staticmethod
+    @Profiler.timed("dictionary_load")
+    def load(language_settings : "LanguageSettings"):
+        d = Dictionary(language_settings.loadBoardWords(), language_settings.loadHintWords(), f"{language_settings.language}_board", language_settings)
+        d.hint_exclusions
+        return d
     
-    #load based on language settings
+    #a hint is too close to a word if one contains the other, or their relative levenshtein distance is at most 50%
     @staticmethod
-    def load():
-        return Dictionary(language_settings.loadBoardWords(), language_settings.loadHintWords(), f"{language_settings.language}_board")
+    def hintTooClose(word : str, hint : str):
+        return word in hint or hint in word or levenshtein_dist(word, hint) / max(len(word), len(hint)) <= 0.5
+    
+    #two dictionaries with the same words have the same hash, regardless of their names
+    @property
+    def content_hash(self):
+        if self._content_hash is None: self._content_hash = utils.hash_value((self.board_words, self.hint_words))
+        return self._content_hash
+    
+    #packed exclusion bitmask for all board words. Loaded from a file next to the weight files if possible, else computed once and saved
+    #the file name contains the content hash, so exclusions computed for different words are never used
+    @property
+    def hint_exclusions(self):
+        if self._hint_exclusions is None:
+            fname = os.path.join("data", f"hint_exclusions_{self.name}_{self.content_hash[:16]}.npy")
+            if utils.file_exists(fname):
+                self._hint_exclusions = utils.load_weights(fname)
+            else:
+                print ("Computing hint exclusions... ", end="", flush=True)
+                excluded = np.array([[Dictionary.hintTooClose(w, h) for h in self.hint_words] for w in self.board_words], dtype=bool)
+                self._hint_exclusions = np.packbits(excluded, 1)
+                utils.save_weights(fname, self._hint_exclusions)
+                print ("Done.", flush=True)
+        return self._hint_exclusions
+    
+    #return a mask of all hints disabled by the given board words (an OR of their exclusion rows)
+    def disabledHints(self, words):
+        return np.unpackbits(np.bitwise_or.reduce(self.hint_exclusions[words], 0), count=self.hint_word_count).astype(bool)
     
     #return the board word with a given index
     def boardWord(self, i : int):
@@ -120,11 +195,11 @@ class Dictionary:
     def contains(self, word):
         return word in self.board_words_inv or word in self.hint_words_inv
     
-    #get an array of random words
-    def randomBoardWords(self):
+    #get an array of count random words
+    def randomBoardWords(self, count : int):
         words = np.arange(self.board_word_count)
         np.random.shuffle(words)
-        return words[:game_settings.card_count]
+        return words[:count]
     
 
 
@@ -190,29 +265,85 @@ class LanguageSettings:
         self.language = language
         self.hint_word_count = hint_word_count
     
-    #open and read the corpora file
-    def openCorpora(self):
-        return open(self.corpora_file).read()
+    #read the corpora file in chunks of chunk_size characters, so that it is never held in memory as a whole
+    def readCorpora(self, chunk_size = 2**22):
+        with open(self.corpora_file) as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk: break
+                yield chunk
+    
+    #yield parts of the corpora separated by the given separator - the same parts as corpora.split(separator), without reading the whole file
+    def splitCorpora(self, separator : str):
+        rest = ""
+        for chunk in self.readCorpora():
+            parts = (rest + chunk).split(separator)
+            rest = parts.pop()
+            yield from parts
+        yield rest
+    
+    #byte offsets (start, end) of about count shards of the corpora file. Every shard except the last one ends right after a separator, so no part is split between two shards
+    def corporaShards(self, separator : str, count : int):
+        size = os.path.getsize(self.corpora_file)
+        offsets = [0]
+        with open(self.corpora_file, "rb") as f:
+            for i in range(1, count):
+                position = max(i * size // count, offsets[-1])
+                f.seek(position)
+                #the shard ends after the first separator found
+                while True:
+                    block = f.read(2**16)
+                    found = block.find(separator.encode())
+                    if not block or found >= 0: break
+                    position += len(block)
+                position = size if not block else position + found + 1
+                if position >= size: break
+                offsets.append(position)
+        return list(zip(offsets, offsets[1:] + [size]))
+    
+    #parts of one shard of the corpora separated by the separator. Parts of all shards, in order, are the same as the parts yielded by splitCorpora
+    def shardParts(self, separator : str, start : int, end : int):
+        with open(self.corpora_file, "rb") as f:
+            f.seek(start)
+            #decoded the same way as the corpora opened in text mode, with universal newlines
+            text = f.read(end - start).decode(locale.getpreferredencoding(False)).replace("\r\n", "\n").replace("\r", "\n")
+        parts = text.split(separator)
+        #the shard ends with the separator, the empty part after it is the start of the next shard
+        if end < os.path.getsize(self.corpora_file): parts.pop()
+        return parts
+    
+    #number of shards to process the corpora in - at least one for every process, and at most shard_size bytes each, so that memory used by a process stays bounded
+    def shardCount(self, processes : typing.Optional[int] = None, shard_size = 2**25):
+        return max(processes or os.cpu_count(), -(-os.path.getsize(self.corpora_file) // shard_size))
+    
+    #yield all sentences in the corpora, each one as a list of words
+    def corporaSentences(self):
+        for sentence in self.splitCorpora("."):
+            yield sentence.split("\n")
+    
+    #yield all words in the corpora, one per line
+    def corporaWords(self):
+        return self.splitCorpora("\n")
     
     #load all board words
     def loadBoardWords(self):
         return utils.load_words(self.board_words_file)
     
     #load all hint words. Generate them from corpora if the file doesn't exist
-    def loadHintWords(self):
+    #words are counted in shards of the corpora, in parallel by the given number of processes (all cpus by default)
+    def loadHintWords(self, processes : typing.Optional[int] = None):
         if utils.file_exists(self.hint_words_file): return utils.load_words(self.hint_words_file)
         print ("Generating hint words... ", end="", flush=True)
-        #compute counts for every word of length > 3 in the corpora
+        #compute counts for every word of length > 3 in the corpora. Counts of shards are merged in the shard order, so words keep the order of their first occurrence in the corpora
         words = {}
-        corpora = self.openCorpora()
-        for word in corpora.split("\n"):
-            if word.isalpha() and len(word) > 3:
-                if not word in words: words[word] = 0
-                words[word] += 1
+        tasks = [(self, start, end) for start, end in self.corporaShards("\n", self.shardCount(processes))]
+        for shard_words in utils.parallel_map(_countShardWords, tasks, processes):
+            for word, count in shard_words.items():
+                words[word] = words.get(word, 0) + count
         #create a list of all words
         words_l = [w for w in words]
         #sort words according to the frequencies computed above, then return N most frequent ones
-        dict_words = sorted(words_l, key=lambda x:words[x], reverse=True)[:language_settings.hint_word_count]
+        dict_words = sorted(words_l, key=lambda x:words[x], reverse=True)[:self.hint_word_count]
         #save the computed words and return them
         utils.save_words(self.hint_words_file, dict_words)
         print ("Done.", flush=True)
@@ -224,6 +355,16 @@ class LanguageSettings:
         return LanguageSettings("data/coca/lemmas_all.txt", "data/fasttext/wiki-news-300d-1M.vec", "data/board_words_en.txt", "data/hint_words_en.txt", "en")
 
 
+#counts of every word of length > 3 in one shard of the corpora, in order of their first occurrence
+def _countShardWords(task):
+    language_settings, start, end = task
+    words = {}
+    for word in language_settings.shardParts("\n", start, end):
+        if word.isalpha() and len(word) > 3:
+            words[word] = words.get(word, 0) + 1
+    return words
+
+
 #one constant for every possible card value
 UNKNOWN = 0
 BLUE = 1
@@ -238,7 +379,7 @@ class BoardDisplaySettings:
     height : int
     cell_width : int
     
-    def __init__(self, width, height):
+    def __init__(self, width, height, dictionary : Dictionary):
         self.width = width
         self.height = height
         self.cell_width = dictionary.max_board_word_length + 1
@@ -257,8 +398,43 @@ class BoardDisplaySettings:
     
     #default render settings 5x5 board,25 cards
     @staticmethod
-    def Default():
-        return BoardDisplaySettings(5, 5)
+    def Default(dictionary : Dictionary):
+        return BoardDisplaySettings(5, 5, dictionary)
+
+
+#all settings and the dictionary used when playing. Nothing is loaded until it is first used, so importing modules stays fast
+class Context:
+    game_settings : GameSettings
+    language_settings : LanguageSettings
+    
+    def __init__(self, game_settings : GameSettings = None, language_settings : LanguageSettings = None, dictionary : Dictionary = None, display_settings : BoardDisplaySettings = None):
+        self.game_settings = game_settings if game_settings is not None else GameSettings.Default()
+        self.language_settings = language_settings if language_settings is not None else LanguageSettings.English()
+        self._dictionary = dictionary
+        self._display_settings = display_settings
+    
+    #the dictionary, loaded based on language settings when first used
+    @property
+    def dictionary(self) -> Dictionary:
+        if self._dictionary is None: self._dictionary = Dictionary.load(self.language_settings)
+        return self._dictionary
+    
+    #display settings, they depend on the dictionary (longest word)
+    @property
+    def display_settings(self) -> BoardDisplaySettings:
+        if self._display_settings is None: self._display_settings = BoardDisplaySettings.Default(self.dictionary)
+        return self._display_settings
+    
+    #the context used when none is given explicitly. Created when first needed, can be replaced using setCurrent
+    _current = None
+    @staticmethod
+    def current() -> "Context":
+        if Context._current is None: Context._current = Context()
+        return Context._current
+    
+    @staticmethod
+    def setCurrent(context : "Context"):
+        Context._current = context
 
 #clear everything in the console. Different for windows and unix systems
 def clear():
@@ -273,10 +449,4 @@ def press_enter_clear():
 
 
 if __name__ == '__main__':
-    import main
-else:
-    #set all settings as global variables
-    game_settings = GameSettings.Default()
-    language_settings = LanguageSettings.English()
-    dictionary = Dictionary.load()
-    display_settings = BoardDisplaySettings.Default()
\ No newline at end of file
+    import main
\ No newline at end of file
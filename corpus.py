@@ -0,0 +1,183 @@
+from common import *
+import scipy.sparse
+
+
+#the whole corpus converted to integer token ids. Built once from the corpus text, then loaded from cache files
+class CorpusIndex:
+    #all distinct tokens in the corpus
+    vocabulary : List[str]
+    #id of every token in the corpus, index into vocabulary
+    tokens : np.ndarray
+    #index of the first token of each sentence, with the total token count at the end
+    sentence_starts : np.ndarray
+
+    def __init__(self, vocabulary : List[str], tokens : np.ndarray, sentence_starts : np.ndarray):
+        self.vocabulary = vocabulary
+        self.tokens = tokens
+        self.sentence_starts = sentence_starts
+
+    @property
+    def sentence_count(self):
+        return len(self.sentence_starts) - 1
+
+    #split sentences from start to end (all by default) into chunks of whole sentences with at most max_tokens tokens each (a longer sentence is a chunk of its own). Yields (first sentence, end sentence) pairs
+    def chunks(self, max_tokens : int, start : int = 0, end : typing.Optional[int] = None):
+        end = self.sentence_count if end is None else end
+        while start < end:
+            chunk_end = int(np.searchsorted(self.sentence_starts, self.sentence_starts[start] + max_tokens, side="right")) - 1
+            chunk_end = min(max(chunk_end, start + 1), end)
+            yield start, chunk_end
+            start = chunk_end
+
+    #count word and sentence collocations for the given dictionary in one pass, both are returned as sparse (board words, hint words) CSR matrices
+    #word collocations - board and hint word are neighbours in a sentence, sentence collocations - board and hint word occur in the same sentence
+    #the corpus is split into ranges of sentences with about the same number of tokens, counted in parallel by the given number of processes (all cpus by default)
+    #partial counts are summed - they are whole numbers, so the result is exactly the same as when counted in one process
+    def countCollocations(self, dictionary : Dictionary, max_tokens : int = 2**24, processes : typing.Optional[int] = None):
+        board_ids = np.array([dictionary.board_words_inv.get(w, -1) for w in self.vocabulary], dtype=np.int32)
+        hint_ids = np.array([dictionary.hint_words_inv.get(w, -1) for w in self.vocabulary], dtype=np.int32)
+        #workers memory map the same index files. An index that is not memory mapped is counted in this process
+        if not isinstance(self.tokens, np.memmap) or not isinstance(self.sentence_starts, np.memmap) or self.sentence_count == 0:
+            return self.countRange(dictionary, board_ids, hint_ids, 0, self.sentence_count, max_tokens)
+        processes = processes or os.cpu_count()
+        bounds = np.searchsorted(self.sentence_starts, np.linspace(0, self.sentence_starts[-1], processes + 1)[1:-1])
+        bounds = np.unique(np.concatenate([[0], bounds, [self.sentence_count]]))
+        tasks = [(self.tokens.filename, self.sentence_starts.filename, dictionary, board_ids, hint_ids, first, end, max_tokens) for first, end in zip(bounds[:-1], bounds[1:])]
+        partial = utils.parallel_map(_countCollocationsRange, tasks, processes)
+        return sum((p[0] for p in partial[1:]), partial[0][0]).tocsr(), sum((p[1] for p in partial[1:]), partial[0][1]).tocsr()
+
+    #count collocations in sentences first to end, in chunks of max_tokens tokens - memory used does not depend on the corpus size. Board and hint ids are dictionary indices of all vocabulary words, -1 if not in it
+    def countRange(self, dictionary : Dictionary, board_ids : np.ndarray, hint_ids : np.ndarray, first_sentence : int, end_sentence : int, max_tokens : int):
+        word_counts = scipy.sparse.csr_matrix(tuple(dictionary.weights_size))
+        sentence_counts = scipy.sparse.csr_matrix(tuple(dictionary.weights_size))
+        for first, end in self.chunks(max_tokens, first_sentence, end_sentence):
+            starts = self.sentence_starts[first:end+1]
+            tokens = np.asarray(self.tokens[starts[0]:starts[-1]])
+            board_i, hint_i = board_ids[tokens], hint_ids[tokens]
+            sentence_i = np.repeat(np.arange(end - first, dtype=np.int32), np.diff(starts))
+            
+            #count all neighbouring pairs in the same sentence, in both directions
+            same_sentence = sentence_i[1:] == sentence_i[:-1]
+            for b, h in ((board_i[1:], hint_i[:-1]), (board_i[:-1], hint_i[1:])):
+                valid = same_sentence & (b >= 0) & (h >= 0)
+                #duplicate pairs are summed when the sparse matrix is created
+                word_counts += scipy.sparse.csr_matrix((np.ones(np.count_nonzero(valid)), (b[valid], h[valid])), shape=dictionary.weights_size)
+
+            #sentence x word matrices - board words are counted with multiplicity, hint words only once per sentence
+            def occurrences(words_i, word_count):
+                valid = words_i >= 0
+                return scipy.sparse.csr_matrix((np.ones(np.count_nonzero(valid)), (sentence_i[valid], words_i[valid])), shape=(end - first, word_count))
+            board_occurrences = occurrences(board_i, dictionary.board_word_count)
+            hint_occurrences = occurrences(hint_i, dictionary.hint_word_count)
+            hint_occurrences.data[:] = 1.0
+            sentence_counts += board_occurrences.T @ hint_occurrences
+        return word_counts.tocsr(), sentence_counts.tocsr()
+
+    #return collocations of the given kind ("word" or "sentence") for the dictionary. Both kinds are counted when the first one is requested. If keep_other is true, the other one
+    #is kept until it is requested too - it should be false when the other weights are cached already, they would never be requested then
+    #counts are kept by the dictionary words (not its name), dictionaries with the same name but different words never get each other's counts
+    _pending_collocations = {}
+    @staticmethod
+    def collocations(dictionary : Dictionary, kind : str, keep_other : bool = True):
+        key = (dictionary.language_settings.language, dictionary.content_hash)
+        pending = CorpusIndex._pending_collocations.pop((*key, kind), None)
+        if pending is not None: return pending
+        word_counts, sentence_counts = CorpusIndex.load(dictionary.language_settings).countCollocations(dictionary)
+        counts = {"word": word_counts, "sentence": sentence_counts}
+        if keep_other:
+            for other, other_counts in counts.items():
+                if other != kind: CorpusIndex._pending_collocations[(*key, other)] = other_counts
+        return counts[kind]
+
+    #tokenize the corpus, given as an iterable of sentences (lists of tokens). Token ids and sentence starts are written to files fname_tokens.bin and fname_sentences.bin in chunks, returns the vocabulary
+    @staticmethod
+    def build(sentences, fname : str, chunk_size : int = 2**20):
+        vocabulary_inv = {}
+        token_count = 0
+        with open(f"{fname}_tokens.bin", "wb") as tokens_f, open(f"{fname}_sentences.bin", "wb") as sentences_f:
+            tokens, sentence_starts = [], [0]
+            for sentence in sentences:
+                tokens.extend(vocabulary_inv.setdefault(w, len(vocabulary_inv)) for w in sentence)
+                sentence_starts.append(token_count + len(tokens))
+                #write everything collected so far, so that memory use stays bounded
+                if len(tokens) >= chunk_size:
+                    tokens_f.write(np.array(tokens, dtype=np.int32).tobytes())
+                    sentences_f.write(np.array(sentence_starts, dtype=np.int64).tobytes())
+                    token_count += len(tokens)
+                    tokens, sentence_starts = [], []
+            tokens_f.write(np.array(tokens, dtype=np.int32).tobytes())
+            sentences_f.write(np.array(sentence_starts, dtype=np.int64).tobytes())
+        return list(vocabulary_inv)
+
+    #build the index from shards of the corpus, tokenized in parallel by the given number of processes (all cpus by default). The result is exactly the same as the one of build
+    #every shard is tokenized with its own vocabulary into temporary files. Vocabularies are then merged in the shard order - words keep the order of their first occurrence in the corpus,
+    #and token ids of each shard are mapped to the merged vocabulary
+    @staticmethod
+    def buildSharded(language_settings : LanguageSettings, fname : str, processes : typing.Optional[int] = None, chunk_size : int = 2**20):
+        shards = language_settings.corporaShards(".", language_settings.shardCount(processes))
+        tasks = [(language_settings, start, end, f"{fname}_shard{i}") for i, (start, end) in enumerate(shards)]
+        try:
+            vocabularies = utils.parallel_map(_buildShard, tasks, processes)
+            vocabulary_inv = {}
+            token_count = 0
+            with open(f"{fname}_tokens.bin", "wb") as tokens_f, open(f"{fname}_sentences.bin", "wb") as sentences_f:
+                sentences_f.write(np.zeros(1, dtype=np.int64).tobytes())
+                for (_, _, _, shard_fname), vocabulary in zip(tasks, vocabularies):
+                    ids = np.array([vocabulary_inv.setdefault(w, len(vocabulary_inv)) for w in vocabulary], dtype=np.int32)
+                    tokens = np.fromfile(f"{shard_fname}_tokens.bin", dtype=np.int32)
+                    for start in range(0, len(tokens), chunk_size):
+                        tokens_f.write(ids[tokens[start:start + chunk_size]].tobytes())
+                    #sentence starts of the shard start with its own 0
+                    sentence_starts = np.fromfile(f"{shard_fname}_sentences.bin", dtype=np.int64)
+                    sentences_f.write((sentence_starts[1:] + token_count).tobytes())
+                    token_count += len(tokens)
+        finally:
+            for _, _, _, shard_fname in tasks:
+                for f in (f"{shard_fname}_tokens.bin", f"{shard_fname}_sentences.bin"):
+                    if utils.file_exists(f): os.remove(f)
+        return list(vocabulary_inv)
+
+    #load the corpus index of the given language from cache files, build it from the corpus if they do not exist. Token ids and sentence starts are memory mapped, they are never loaded as a whole
+    _loaded = {}
+    @staticmethod
+    def load(language_settings : LanguageSettings):
+        if language_settings.language not in CorpusIndex._loaded:
+            #the name of the files contains a hash of the size and modification time of the corpus, so the index is rebuilt when it changes
+            key = utils.hash_value((language_settings.corpora_file, utils.file_signature(language_settings.corpora_file)))
+            fname = os.path.join("data", f"corpus_{language_settings.language}_{key[:16]}")
+            if not all(utils.file_exists(f"{fname}_{f}") for f in ("vocabulary.txt", "tokens.bin", "sentences.bin")):
+                print ("Indexing corpus... ", end="", flush=True)
+                #the index is built in a directory of its own and moved to the final names when complete, so a crash never leaves truncated files behind, and more processes building
+                #the same index do not write into each other's files (they build the same files, whichever is moved last is kept)
+                os.makedirs(os.path.dirname(fname), exist_ok=True)
+                build_dir = tempfile.mkdtemp(dir=os.path.dirname(fname), prefix=os.path.basename(fname) + ".", suffix=".tmp")
+                try:
+                    vocabulary = CorpusIndex.buildSharded(language_settings, os.path.join(build_dir, "corpus"))
+                    for f in ("tokens.bin", "sentences.bin"): os.replace(os.path.join(build_dir, f"corpus_{f}"), f"{fname}_{f}")
+                finally:
+                    for f in os.listdir(build_dir): os.remove(os.path.join(build_dir, f))
+                    os.rmdir(build_dir)
+                #tokens never contain newlines, so they can be saved one per line. Vocabulary is saved last - it marks the index as complete
+                utils.atomic_write(f"{fname}_vocabulary.txt", lambda f: f.write("\n".join(vocabulary).encode("utf-8")))
+                print ("Done.", flush=True)
+            with open(f"{fname}_vocabulary.txt", encoding="utf-8") as f:
+                vocabulary = f.read().split("\n")
+            CorpusIndex._loaded[language_settings.language] = CorpusIndex(vocabulary, np.memmap(f"{fname}_tokens.bin", dtype=np.int32, mode='r'), np.memmap(f"{fname}_sentences.bin", dtype=np.int64, mode='r'))
+        return CorpusIndex._loaded[language_settings.language]
+
+
+
+#tokenize one shard of the corpus into files fname_tokens.bin and fname_sentences.bin, with ids into its own vocabulary. Returns the vocabulary
+def _buildShard(task):
+    language_settings, start, end, fname = task
+    return CorpusIndex.build((sentence.split("\n") for sentence in language_settings.shardParts(".", start, end)), fname)
+
+#count collocations in a range of sentences of the memory mapped index
+def _countCollocationsRange(task):
+    tokens_fname, sentences_fname, dictionary, board_ids, hint_ids, first, end, max_tokens = task
+    index = CorpusIndex(None, np.memmap(tokens_fname, dtype=np.int32, mode='r'), np.memmap(sentences_fname, dtype=np.int64, mode='r'))
+    return index.countRange(dictionary, board_ids, hint_ids, first, end, max_tokens)
+
+
+if __name__ == "__main__":
+    import main
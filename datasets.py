@@ -1,92 +1,197 @@
 import typing
+import hashlib
+import multiprocessing
 from common import *
-import io
+from corpus import CorpusIndex
 
 
 #base class for all initializers
 class ModelInitializer:   
+    #weights are cached in data/cache/{weights_filename}_{dictionary name}_{cache key}, they are not cached if this is None
     weights_filename : typing.Optional[str] = None
+    #if true, computed weights are a scipy.sparse CSR matrix, and are saved as .npz instead of .npy
+    sparse : bool = False
+    #increase when the way weights are computed changes, all previously cached weights are then ignored
+    CACHE_VERSION = 1
     
-    #should be overriden by child classes. Return weights - these will be saved in the file later
+    #should be overriden by child classes. Return weights - these will be transformed and saved in the file later
     def computeWeights(self, dictionary : Dictionary):
         return np.zeros(dictionary.weights_size)
     
-    #load weights from a file if possible, else use the computeWeights method to compute them
-    def getWeights(self, dictionary : Dictionary = dictionary):
-        weights_filename = None if self.weights_filename is None else os.path.join("data", f"{self.weights_filename}_{dictionary.name}.npy")
+    #files the weights are computed from. Their sizes and modification times are a part of the cache key, so weights are recomputed when they change
+    def inputFiles(self, dictionary : Dictionary) -> List[str]:
+        return []
+    
+    #weights of other initializers that computeWeights reads, as (initializer, dictionary) pairs. The initializer graph computes them first, each one only once
+    def dependencies(self, dictionary : Dictionary) -> List[typing.Tuple["ModelInitializer", Dictionary]]:
+        return []
+    
+    #weights that getWeightTiles reads. By default, tiles are sliced from the whole weights of this initializer
+    def tileDependencies(self, dictionary : Dictionary) -> List[typing.Tuple["ModelInitializer", Dictionary]]:
+        return [(self, dictionary)]
+    
+    #initializers with the same key share a part of their computation (e.g. one pass over the corpus), the initializer graph computes them in the same process. None if nothing is shared
+    def sharedWorkKey(self, dictionary : Dictionary):
+        return None
+    
+    #prepare inputs shared with other initializers (e.g. an index of the corpus) before the initializer graph computes them in parallel, so that no two processes create them at once
+    def prepare(self, dictionary : Dictionary):
+        pass
+    
+    #true if the weights can be returned without computing them
+    def isAvailable(self, dictionary : Dictionary):
+        weights_filename = self.cacheFilename(dictionary)
+        return weights_filename is not None and utils.file_exists(weights_filename)
+    
+    #parameters that change the computed weights. All attributes by default, child classes can remove those that don't change the result
+    def cacheParams(self):
+        return {k: v for k, v in vars(self).items() if k != "weights_filename"}
+    
+    #hash of everything the weights depend on - initializer class, its parameters (including child initializers), dictionary words, and input files
+    def cacheKey(self, dictionary : Dictionary):
+        def param(v):
+            if isinstance(v, ModelInitializer): return v.cacheKey(dictionary)
+            if isinstance(v, (list, tuple)): return [param(x) for x in v]
+            return v
+        params = sorted((k, param(v)) for k, v in self.cacheParams().items())
+        files = [(f, utils.file_signature(f)) for f in self.inputFiles(dictionary)]
+        return utils.hash_value((type(self).__name__, ModelInitializer.CACHE_VERSION, params, dictionary.content_hash, files))
+    
+    #name of the file with cached weights for the given dictionary, None if weights are not cached
+    def cacheFilename(self, dictionary : Dictionary):
+        if self.weights_filename is None: return None
+        return os.path.join("data", "cache", f"{self.weights_filename}_{dictionary.name}_{self.cacheKey(dictionary)[:16]}.{'npz' if self.sparse else 'npy'}")
+    
+    #load transformed weights from the cache if possible, else use the computeWeights and transformWeights methods to compute them
+    #if dictionary is None, the dictionary of the current context is used. Cached dense weights are memory mapped and read-only
+    #weights with dependencies are computed by an InitializerGraph, which computes every dependency only once
+    def getWeights(self, dictionary : Dictionary = None):
+        if dictionary is None: dictionary = Context.current().dictionary
+        #weights already computed by the running initializer graph
+        if InitializerGraph.evaluated:
+            ws = InitializerGraph.evaluated.get(self.cacheKey(dictionary))
+            if ws is not None: return ws
+        weights_filename = self.cacheFilename(dictionary)
         #if weights can be loaded, load them
         if weights_filename is not None and utils.file_exists(weights_filename):
-            ws = utils.load_weights(weights_filename)
+            with Profiler.phase(f"weights_load.{type(self).__name__}"):
+                ws = utils.load_weights(weights_filename, mmap_mode='r')
+        #compute all dependencies first
+        elif not InitializerGraph.running and self.dependencies(dictionary):
+            return InitializerGraph(self, dictionary).evaluate()
         #compute all weights
         else:
             print (f"Generating weights for {type(self).__name__}... ", end="", flush=True)
-            ws = self.computeWeights(dictionary)
-            #save weights if they should be saved
-            if weights_filename is not None: utils.save_weights(weights_filename, ws)
+            with Profiler.phase(f"weights_compute.{type(self).__name__}"):
+                #transform weights - this is division by the largest value by default, can be overriden by child classes too
+                ws = self.transformWeights(self.computeWeights(dictionary))
+                #save weights if they should be saved
+                if weights_filename is not None: utils.save_weights(weights_filename, ws)
             print ("Done.", flush=True)
-        #transform weights - this is division by the largest value by default, can be overriden by child classes too
-        ws = self.transformWeights(ws)
         #if computed weights do not match the dictionary, throw an error
         assert ws.shape[0] == len(dictionary.board_words) and ws.shape[1] == len(dictionary.hint_words), "Computed weights do not have the required dimensions"
         return ws
 
+    #yield (start, end, tile) for all column tiles of the transformed weights, tile is a dense array of shape (board words, end - start). Tiles must not be modified
+    #by default, all weights are computed and then sliced. Child classes can override this to compute tiles without ever creating the whole matrix
+    def getWeightTiles(self, dictionary : Dictionary, tile_size : int, dtype = np.float64):
+        ws = self.getWeights(dictionary)
+        #column slices of a CSC matrix are cheap
+        if scipy.sparse.issparse(ws): ws = ws.tocsc()
+        for start in range(0, dictionary.hint_word_count, tile_size):
+            end = min(start + tile_size, dictionary.hint_word_count)
+            yield start, end, utils.dense(ws[:, start:end]).astype(dtype, copy=False)
+
+    #dense weights already opened in this process, by file name. All models created from the same (or an equal) initializer share one read-only array
+    _shared_weights = {}
+    
+    #get weights as a dense read-only array of the given dtype. Cached weights are memory mapped from their file, so processes using the same weights share the page cache instead of holding their own copies
+    #weights are always computed in float64. Sparse weights and weights in a different dtype (e.g. np.float32 or np.float16) are converted once, and the result is cached as a .npy file next to the original one
+    #if hint_major is true, the weights are transposed to shape (hint words, board words) - all weights of one hint are then next to each other in memory
+    #weights that are not cached are never copied just to transpose them - the result is then a transposed view, with the memory layout of the original weights
+    def getDenseWeights(self, dictionary : Dictionary = None, dtype = np.float64, hint_major = False):
+        if dictionary is None: dictionary = Context.current().dictionary
+        dtype = np.dtype(dtype)
+        def convert(ws):
+            ws = utils.dense(ws).astype(dtype, copy=False)
+            return np.ascontiguousarray(ws.T) if hint_major else ws
+        weights_filename = self.cacheFilename(dictionary)
+        if weights_filename is None:
+            ws = utils.dense(self.getWeights(dictionary)).astype(dtype, copy=False)
+            return ws.T if hint_major else ws
+        converted = self.sparse or dtype != np.float64 or hint_major
+        dense_filename = os.path.splitext(weights_filename)[0] + ("_dense" if self.sparse else "") + ("" if dtype == np.float64 else f"_{dtype.name}") + ("_hint_major" if hint_major else "") + ".npy"
+        if dense_filename not in ModelInitializer._shared_weights:
+            if not utils.file_exists(dense_filename):
+                #computes and saves weights, converted ones are saved here
+                ws = self.getWeights(dictionary)
+                if converted: utils.save_weights(dense_filename, convert(ws))
+            ModelInitializer._shared_weights[dense_filename] = utils.load_weights(dense_filename, mmap_mode='r')
+        return ModelInitializer._shared_weights[dense_filename]
+
     #return a new weights array matching the dictionary, with given value
-    def newWeights(self, dictionary : Dictionary, default = 0.0):
-        return np.full(dictionary.weights_size, default)
+    def newWeights(self, dictionary : Dictionary, default = 0.0, dtype = np.float64):
+        return np.full(dictionary.weights_size, default, dtype=dtype)
 
-    #divide weights by their largest value. Can be overriden in child classes
+    #divide weights by their largest value. Can be overriden in child classes. Works for both dense and sparse weights
     def transformWeights(self, weights):
-        return weights / np.max(weights)
+        return weights / weights.max()
    
    
 #collocations initializer
 class CollocationsInitializer(ModelInitializer):
+    #most counts are zero, keep them in a sparse matrix
+    sparse = True
+    
+    #kind of the collocations, "word" or "sentence"
+    kind : str
+    
+    #word and sentence collocations are counted in one pass over the corpus
+    def sharedWorkKey(self, dictionary : Dictionary):
+        return ("collocations", dictionary.content_hash)
+    
+    def inputFiles(self, dictionary : Dictionary):
+        return [dictionary.language_settings.corpora_file]
+    
+    #the other kind of collocations, counted in the same pass
+    def counterpart(self) -> "CollocationsInitializer":
+        return SentenceCollocationsInitializer() if self.kind == "word" else WordCollocationsInitializer()
+    
+    #note - weights will be transformed using the transformWeights method before being used. The counts of the other kind are kept for it, unless its weights are cached already
+    def computeWeights(self, dictionary : Dictionary):
+        return CorpusIndex.collocations(dictionary, self.kind, not self.counterpart().isAvailable(dictionary))
+    
+    #the corpus index is built once, before collocations of all dictionaries are counted
+    def prepare(self, dictionary : Dictionary):
+        CorpusIndex.load(dictionary.language_settings)
+    
     #before dividing by max value, remove all values smaller than 5, divide by the sum in each row, add 1.0, and take the logarithm of that
     def transformWeights(self, weights):
-        return super().transformWeights(np.log(np.where(weights > 5, weights, 0) / (np.sum(weights, 0, keepdims=True) + 1e-4) + 1.0))
+        if not scipy.sparse.issparse(weights):
+            return super().transformWeights(np.log(np.where(weights > 5, weights, 0) / (np.sum(weights, 0, keepdims=True) + 1e-4) + 1.0))
+        #log(0 + 1) = 0, so the transformation only has to be applied to the stored values larger than 5
+        sums = np.asarray(weights.sum(0)).ravel() + 1e-4
+        weights = weights.tocoo()
+        kept = weights.data > 5
+        data = np.log(weights.data[kept] / sums[weights.col[kept]] + 1.0)
+        return super().transformWeights(scipy.sparse.csr_matrix((data, (weights.row[kept], weights.col[kept])), shape=weights.shape))
 
 
-#initializer for word collocations
+#initializer for word collocations - neighbouring words in all sentences of the corpus
 class WordCollocationsInitializer(CollocationsInitializer):
+    kind = "word"
+    
     def __init__(self, fname = "word_collocations"):
         self.weights_filename = fname
     
-    def computeWeights(self, dictionary : Dictionary):
-        weights = self.newWeights(dictionary)
-        #go over all sentences in the corpora
-        for sentence in language_settings.openCorpora().split("."):
-            #go over all words get hint and word index for each one
-            words = sentence.split("\n")
-            board_words_i = [dictionary.boardWordI(w) for w in words]
-            hint_words_i = [dictionary.hintWordI(w) for w in words]
-            #go over all neighboring words, if they both are in the respective dictionaries, add 1 to the respective spot weights matrix
-            for b, h in zip(board_words_i[1:], hint_words_i[:-1]):
-                if b is not None and h is not None:
-                    weights[b, h] += 1
-            for b, h in zip(board_words_i[:-1], hint_words_i[1:]):
-                if b is not None and h is not None:
-                    weights[b, h] += 1
-        #note - weights will be transformed using the parent transformWeights method before being used
-        return weights
     
-    
-#initializer for sentence collocations
+#initializer for sentence collocations - board and hint words in the same sentence, each board word occurrence counts every hint word in its sentence once
 class SentenceCollocationsInitializer(CollocationsInitializer):
+    kind = "sentence"
+    
     def __init__(self, fname = "sentence_collocations"):
         self.weights_filename = fname
 
-    def computeWeights(self, dictionary : Dictionary):
-        weights = self.newWeights(dictionary)
-        #go over all sentences in the corpora
-        for sentence in language_settings.openCorpora().split("."):
-            words = sentence.split("\n")
-            board_words_i = list(filter(lambda x: x is not None, [dictionary.boardWordI(w) for w in words]))
-            hint_words_i  = list(filter(lambda x: x is not None, [dictionary.hintWordI(w) for w in words]))
-            #for all doubles in hint words i, board words i: add 1 to the target spot
-            for b in board_words_i:
-                weights[b, hint_words_i] += 1
-        return weights
-
 
 
 #fast text initializer 
@@ -98,35 +203,79 @@ class FastTextInitializer(ModelInitializer):
         self.hint_threshold = hint_threshold
         self.weights_filename = fname
 
-    def computeWeights(self, dictionary : Dictionary):
-        #open fast text embeddings file
-        fin = io.open(language_settings.fast_text_file, 'r', encoding='utf-8', newline='\n', errors='ignore')
-        n, d = map(int, fin.readline().split())
-        #load embeddings into a dictionary - one element for a word and its embedding
-        data = {}
-        for line in fin:
-            tokens = line.rstrip().split(' ')
-            word = tokens[0]
-            embed = np.array(list(map(float, tokens[1:])))
-            if dictionary.contains(word):
-                data[word] = embed
+    #load embeddings for all dictionary words. Returns a list of words and a float32 array of their embeddings, NaN for words without an embedding
+    #the first run scans the text file and parses only lines of dictionary words, the result is cached as a .npy file and memory mapped by all later runs
+    @staticmethod
+    def loadEmbeddings(dictionary : Dictionary):
+        #the names of the files contain a hash of the size and modification time of the embeddings file, so embeddings are read again when it changes
+        fast_text_file = dictionary.language_settings.fast_text_file
+        key = utils.hash_value((fast_text_file, utils.file_signature(fast_text_file)))[:16]
+        words_fname, vectors_fname = os.path.join("data", f"fasttext_words_{dictionary.name}_{key}.txt"), os.path.join("data", f"fasttext_vectors_{dictionary.name}_{key}.npy")
+        required = set(dictionary.board_words) | set(dictionary.hint_words)
+        #cache can be used if it contains all words in the dictionary (it was created for the same dictionary or a larger one)
+        if utils.file_exists(words_fname) and utils.file_exists(vectors_fname):
+            words = utils.load_words(words_fname)
+            if required.issubset(words):
+                return words, np.load(vectors_fname, mmap_mode='r')
+        
+        words = sorted(required)
+        word_i = {w:i for i, w in enumerate(words)}
+        vectors = None
+        with open(fast_text_file, 'rb') as fin:
+            n, d = map(int, fin.readline().split())
+            vectors = np.full([len(words), d], np.nan, dtype=np.float32)
+            for line in fin:
+                #only decode the word, the rest of the line is parsed just for words that are in the dictionary
+                word, _, embed = line.partition(b' ')
+                i = word_i.get(word.decode('utf-8', errors='ignore'))
+                if i is not None:
+                    vectors[i] = np.array(embed.split(), dtype=np.float32)
+        utils.save_words(words_fname, words)
+        utils.save_weights(vectors_fname, vectors)
+        return words, vectors
+
+    #return embeddings of board and hint words in the given dtype, normalized to length 1 in euclidean space. Words without an embedding have NaN embeddings
+    @staticmethod
+    def normalizedEmbeddings(dictionary : Dictionary, dtype = np.float64):
+        words, vectors = FastTextInitializer.loadEmbeddings(dictionary)
+        word_i = {w:i for i, w in enumerate(words)}
         
         #get a list of words, return a list of embeddings normalized to length 1 in euclidean space
         def embed(ws):
-            elem = next(iter(data.values()))
-            vals = np.stack([data.get(word, np.full_like(elem, np.nan)) for word in ws])
+            vals = vectors[[word_i[word] for word in ws]].astype(dtype)
             lens = np.sqrt(np.sum(vals*vals, 1, keepdims=True))
             return vals / lens
         
         #embed both board and hint words
-        board_embeds = embed(dictionary.board_words)
-        hint_embeds = np.transpose(embed(dictionary.hint_words), [1, 0])
-        
-        #compute weights. Same as cosine similarity between words / 2 + 0.5
-        weights = board_embeds @ hint_embeds / 2 + 0.5
+        return embed(dictionary.board_words), embed(dictionary.hint_words)
+    
+    #weights for given board embeddings and hint embeddings. Same as cosine similarity between words / 2 + 0.5
+    @staticmethod
+    def cosineWeights(board_embeds, hint_embeds):
+        weights = board_embeds @ hint_embeds.T / 2 + 0.5
         #if embedding didn't exist, the weights were set to nan -> all values relative to this embedding are now nan. Set them all to 0 (completely unrelated)
-        weights = np.nan_to_num(weights)
-        return weights
+        return np.nan_to_num(weights)
+
+    def inputFiles(self, dictionary : Dictionary):
+        return [dictionary.language_settings.fast_text_file]
+    
+    #tiles are computed from the embeddings, no weights are needed
+    def tileDependencies(self, dictionary : Dictionary):
+        return []
+    
+    #embeddings of dictionary words are cached in files named by the dictionary
+    def prepare(self, dictionary : Dictionary):
+        FastTextInitializer.loadEmbeddings(dictionary)
+
+    def computeWeights(self, dictionary : Dictionary):
+        return FastTextInitializer.cosineWeights(*FastTextInitializer.normalizedEmbeddings(dictionary))
+    
+    #tiles are computed directly from the embeddings in the tile dtype, the whole weights matrix is never created
+    def getWeightTiles(self, dictionary : Dictionary, tile_size : int, dtype = np.float64):
+        board_embeds, hint_embeds = FastTextInitializer.normalizedEmbeddings(dictionary, dtype)
+        for start in range(0, dictionary.hint_word_count, tile_size):
+            end = min(start + tile_size, dictionary.hint_word_count)
+            yield start, end, self.transformWeights(FastTextInitializer.cosineWeights(board_embeds, hint_embeds[start:end])).astype(dtype, copy=False)
     
     #transform weights - subtract threshold from all, all smaller than 0 are set to 0. Then rescale the remaining values to lie between 0 and 1
     def transformWeights(self, weights):
@@ -134,14 +283,24 @@ class FastTextInitializer(ModelInitializer):
 
 #word associations
 class WordAssociationInitializer(ModelInitializer):
-    def __init__(self, fname = "word_associations"):
+    #only word pairs present in the dataset have a non-zero weight
+    sparse = True
+    
+    ASSOCIATIONS_FILE = "data/associations/data.txt"
+    
+    def __init__(self, fname = "word_associations", associations_file = ASSOCIATIONS_FILE):
         self.weights_filename = fname 
+        self.associations_file = associations_file
+    
+    def inputFiles(self, dictionary : Dictionary):
+        return [self.associations_file]
     
     def computeWeights(self, dictionary : Dictionary):
         #base word, associated word, forward link strength, mediated link strength
         WBASE, WASSOC, FSG, MSG = 0, 1, 5, 7
-        lines = open("data/associations/data.txt").read().splitlines()
-        weights = self.newWeights(dictionary)
+        lines = open(self.associations_file).read().splitlines()
+        #weights are collected as (board word, hint word, weight) triplets, duplicates are summed when creating the sparse matrix
+        rows, cols, data = [], [], []
         #go over all word combinations in the dataset
         for l in lines:
             a = l.lower().split(", ")
@@ -154,8 +313,39 @@ class WordAssociationInitializer(ModelInitializer):
                     w += float(a[MSG])
                 except ValueError:
                     pass
-                weights[bw, hw] += w
-        return weights
+                rows.append(bw)
+                cols.append(hw)
+                data.append(w)
+        return scipy.sparse.csr_matrix((data, (rows, cols)), shape=dictionary.weights_size)
+
+#uses weights that were already computed (e.g. shared between processes). Weights are used as they are, without copying or transforming them
+class ArrayInitializer(ModelInitializer):
+    array : np.ndarray
+    #the same weights in the hint-major layout (e.g. memory mapped from a file shared by more processes). If None, hint-major weights are a transposed view of the array
+    hint_major_array : typing.Optional[np.ndarray]
+    
+    def __init__(self, array : np.ndarray, hint_major_array : typing.Optional[np.ndarray] = None):
+        self.array = array
+        self.hint_major_array = hint_major_array
+    
+    def getDenseWeights(self, dictionary : Dictionary = None, dtype = np.float64, hint_major = False):
+        if hint_major and self.hint_major_array is not None and self.hint_major_array.dtype == np.dtype(dtype):
+            if dictionary is None: dictionary = Context.current().dictionary
+            assert self.hint_major_array.shape == (dictionary.hint_word_count, dictionary.board_word_count), "Given hint-major weights do not have the required dimensions"
+            return self.hint_major_array
+        return super().getDenseWeights(dictionary, dtype, hint_major)
+    
+    def getWeights(self, dictionary : Dictionary = None):
+        if dictionary is None: dictionary = Context.current().dictionary
+        assert self.array.shape[0] == len(dictionary.board_words) and self.array.shape[1] == len(dictionary.hint_words), "Given weights do not have the required dimensions"
+        return self.array
+    
+    def isAvailable(self, dictionary : Dictionary):
+        return True
+    
+    #the array is identified by a hash of its contents, the hint-major array holds the same weights
+    def cacheParams(self):
+        return {"array": hashlib.sha1(np.ascontiguousarray(self.array)).hexdigest()}
 
 #combines multiple initializaers into one
 class CombinedInitializer(ModelInitializer):
@@ -163,25 +353,72 @@ class CombinedInitializer(ModelInitializer):
     initializers : list[ModelInitializer]
     weights : list[float]
     
-    def __init__(self, initializers, weights):
+    def __init__(self, initializers, weights, fname = "combined"):
         self.initializers = initializers
         self.weights = weights
+        self.weights_filename = fname
         
+    #the result is sparse only if all combined initializers are sparse
+    @property
+    def sparse(self):
+        return all(i.sparse for i in self.initializers)
+    
+    def dependencies(self, dictionary : Dictionary):
+        return [(i, dictionary) for i in self.initializers]
+    
+    #tiles are sums of the tiles of all combined initializers
+    def tileDependencies(self, dictionary : Dictionary):
+        return [d for i in self.initializers for d in i.tileDependencies(dictionary)]
+    
+    #add ws * w to the weights in place. Dense weights are added in blocks of rows through one small buffer, no temporary array of the full size is created
+    #sparse weights are added to their non-zero positions only
+    @staticmethod
+    def addWeighted(weights : np.ndarray, ws, w : float, block_size : int = 2**16):
+        if scipy.sparse.issparse(ws):
+            ws = ws.tocoo()
+            weights[ws.row, ws.col] += ws.data * w
+            return
+        rows = max(1, block_size // weights.shape[1])
+        buffer = np.empty([min(rows, weights.shape[0]), weights.shape[1]], dtype=weights.dtype)
+        for start in range(0, weights.shape[0], rows):
+            end = min(start + rows, weights.shape[0])
+            np.multiply(ws[start:end], w, out=buffer[:end - start])
+            weights[start:end] += buffer[:end - start]
+    
     def computeWeights(self, dictionary : Dictionary):
+        if self.sparse:
+            return sum(i.getWeights(dictionary) * w for w, i in zip(self.weights, self.initializers))
         weights = self.newWeights(dictionary)
         #go over all initializers and sum their weights
         for w, i in zip(self.weights, self.initializers):
-            weights += i.getWeights(dictionary) * w
+            CombinedInitializer.addWeighted(weights, i.getWeights(dictionary), w)
         return weights
     
+    #yield (start, end, tile) with the sums of weighted tiles of all initializers, before they are divided by the largest value. Each tile of the combined initializers is computed once
+    def sumTiles(self, dictionary : Dictionary, tile_size : int, dtype = np.float64):
+        for tiles in zip(*[i.getWeightTiles(dictionary, tile_size, dtype) for i in self.initializers]):
+            start, end, _ = tiles[0]
+            tile = np.zeros([dictionary.board_word_count, end - start], dtype=dtype)
+            for w, (_, _, t) in zip(self.weights, tiles):
+                CombinedInitializer.addWeighted(tile, t, w)
+            yield start, end, tile
+
+    #summed tiles divided by their largest value, which is only known after all tiles were summed - they are summed twice. Users that are linear in the tiles
+    #(like the double link initializer) should use sumTiles and divide their result instead
+    def getWeightTiles(self, dictionary : Dictionary, tile_size : int, dtype = np.float64):
+        max_value = max(tile.max() for _, _, tile in self.sumTiles(dictionary, tile_size, dtype))
+        for start, end, tile in self.sumTiles(dictionary, tile_size, dtype):
+            tile /= max_value
+            yield start, end, tile
+    
     DEFAULT_FASTTEXT_THRESHOLD = 0.685
     @staticmethod
     def DefaultInitializer(fast_text_threshold = DEFAULT_FASTTEXT_THRESHOLD):
         #create a combined initializer from all basic datasets
-        basic = CombinedInitializer([WordCollocationsInitializer(), SentenceCollocationsInitializer(), FastTextInitializer(fast_text_threshold), WordAssociationInitializer()], [1, 0.5, 0.75, 1])
+        basic = CombinedInitializer([WordCollocationsInitializer(), SentenceCollocationsInitializer(), FastTextInitializer(fast_text_threshold), WordAssociationInitializer()], [1, 0.5, 0.75, 1], "basic")
 
-        #create a combined dataset of the basic dataset and the double link initializer of the basic dataset
-        return CombinedInitializer([basic, DoubleLinkInitializer(basic)], [1.0, 1.0])
+        #create a combined dataset of the basic dataset and the double link initializer of the basic dataset. Once cached, the default model is loaded from a single file
+        return CombinedInitializer([basic, DoubleLinkInitializer(basic)], [1.0, 1.0], "default")
 
 
 
@@ -189,26 +426,149 @@ class CombinedInitializer(ModelInitializer):
 #if a is close to b and b is close to c, humans will think of the connection a->c
 class DoubleLinkInitializer(ModelInitializer):
     c_initializer : CombinedInitializer
+    #number of links between the board word and the hint - 2 means a->b->c, 3 means a->b->c->d, and so on
+    hops : int
     
-    def __init__(self, combined_initializer : CombinedInitializer, fname="double_link"):
-        self.weights_filename = fname
+    #the hint x hint weights are never created as a whole - they are processed in column tiles of tile_size hints, in the given dtype
+    #if sparse_tiles is true, tiles are converted to sparse matrices before multiplying (faster when most weights are zero)
+    def __init__(self, combined_initializer : CombinedInitializer, fname="double_link", hops = 2, tile_size = 1024, dtype = np.float64, sparse_tiles = False):
+        self.weights_filename = fname if hops == 2 else f"{fname}_{hops}"
         self.c_initializer = combined_initializer
+        self.hops = hops
+        self.tile_size = tile_size
+        self.dtype = dtype
+        self.sparse_tiles = sparse_tiles
+    
+    #tile size and sparse tiles change only the speed of the computation, not the result
+    def cacheParams(self):
+        return {k: v for k, v in super().cacheParams().items() if k not in ("tile_size", "sparse_tiles")}
+    
+    #dictionary hint words * hint words
+    @staticmethod
+    def fullDictionary(dictionary : Dictionary):
+        return Dictionary(dictionary.hint_words, dictionary.hint_words, f"{dictionary.language_settings.language}_full", dictionary.language_settings)
+    
+    #combined weights for the dictionary, and everything the hint x hint tiles are computed from
+    def dependencies(self, dictionary : Dictionary):
+        return [(self.c_initializer, dictionary)] + self.c_initializer.tileDependencies(DoubleLinkInitializer.fullDictionary(dictionary))
 
     def computeWeights(self, dictionary: Dictionary):
-        #dictionary hint words * hint words
-        full_dict = Dictionary(dictionary.hint_words, dictionary.hint_words, f"{language_settings.language}_full")
-        #get weights for the full dictionary
-        full_ws = self.c_initializer.getWeights(full_dict)
-        #forbid each word from relating to itself
-        np.fill_diagonal(full_ws, 0)
+        full_dict = DoubleLinkInitializer.fullDictionary(dictionary)
         
-        board_ws = self.c_initializer.getWeights(dictionary)
-        
-        #compute mediated weights for all words
-        weights = board_ws @ full_ws
+        weights = self.c_initializer.getDenseWeights(dictionary).astype(self.dtype)
+        #each hop multiplies the current weights by the hint x hint weights, one column tile at a time. Memory used is (board words + hint words) x tile size
+        #the tiles are not divided by the largest combined weight, so that they are computed only once. The hop is linear in them, its result is divided instead
+        for _ in range(self.hops - 1):
+            linked = np.zeros_like(weights)
+            max_value = 0
+            for start, end, tile in self.c_initializer.sumTiles(full_dict, self.tile_size, self.dtype):
+                max_value = max(max_value, tile.max())
+                linked[:, start:end] = weights @ (scipy.sparse.csr_matrix(tile) if self.sparse_tiles else tile)
+                #forbid each word from relating to itself - remove the contribution of the diagonal of the hint x hint weights
+                linked[:, start:end] -= weights[:, start:end] * tile[np.arange(start, end), np.arange(end - start)]
+            linked /= max_value
+            weights = linked
         #forbid word having a weight to itself
         np.fill_diagonal(weights, 0)
         return weights
+
+
+#one node of the initializer graph - weights of one initializer for one dictionary
+class InitializerNode:
+    def __init__(self, initializer : ModelInitializer, dictionary : Dictionary, key : str):
+        self.initializer = initializer
+        self.dictionary = dictionary
+        #cache key of the weights, equal initializers with equal dictionaries are one node
+        self.key = key
+        #nodes whose weights are needed to compute this one
+        self.dependencies : List["InitializerNode"] = []
+        #number of nodes that still need the weights of this one
+        self.consumers = 0
+
+
+#compute the given (initializer, dictionary) pairs in a worker process. Weights saved to the cache are loaded from there by the main process, only other weights are sent back
+def _computeNodes(task):
+    pairs, profile = task
+    Profiler.enable(profile)
+    Profiler.reset()
+    results = []
+    for initializer, dictionary in pairs:
+        ws = initializer.getWeights(dictionary)
+        results.append(ws if initializer.cacheFilename(dictionary) is None else None)
+    return results, Profiler.takeSnapshot()
+
+
+#resolves the tree of initializers into a graph of (initializer, dictionary) nodes, and computes every node at most once
+#weights that are available (cached) are not computed, and neither are their dependencies. Leaves are computed in parallel in a process pool, the rest in the main process
+#in dependency order. Computed weights are kept in memory only until the last node that needs them is computed
+class InitializerGraph:
+    #true while a graph is being computed in this process. Initializers then compute their weights directly, instead of creating another graph
+    running = False
+    #weights computed by the running graph that some node still needs, by node key
+    evaluated : Dict[str, typing.Any] = {}
+    
+    def __init__(self, initializer : ModelInitializer, dictionary : Dictionary = None, processes : typing.Optional[int] = None):
+        self.dictionary = dictionary if dictionary is not None else Context.current().dictionary
+        self.initializer = initializer
+        self.processes = processes or os.cpu_count()
+        self.nodes : Dict[str, InitializerNode] = {}
+        #nodes to compute, every node is after all of its dependencies
+        self.order : List[InitializerNode] = []
+        self.root = self.addNode(initializer, self.dictionary)
+    
+    #add the node and all its dependencies that have to be computed, return the node or None if it is available already
+    def addNode(self, initializer : ModelInitializer, dictionary : Dictionary):
+        if initializer.isAvailable(dictionary): return None
+        key = initializer.cacheKey(dictionary)
+        if key not in self.nodes:
+            node = self.nodes[key] = InitializerNode(initializer, dictionary, key)
+            for i, d in initializer.dependencies(dictionary):
+                dependency = self.addNode(i, d)
+                if dependency is not None:
+                    dependency.consumers += 1
+                    node.dependencies.append(dependency)
+            self.order.append(node)
+        return self.nodes[key]
+    
+    #compute the leaves - grouped by their shared work, in a pool if there is more than one group. Daemon processes (e.g. pool workers) cannot start a pool of their own
+    def computeLeaves(self, leaves : List[InitializerNode]):
+        for node in leaves: node.initializer.prepare(node.dictionary)
+        groups = {}
+        for node in leaves:
+            shared = node.initializer.sharedWorkKey(node.dictionary)
+            groups.setdefault(node.key if shared is None else shared, []).append(node)
+        groups = list(groups.values())
+        tasks = [([(n.initializer, n.dictionary) for n in group], Profiler.enabled) for group in groups]
+        if len(groups) > 1 and self.processes > 1 and not multiprocessing.current_process().daemon:
+            with multiprocessing.Pool(min(self.processes, len(groups))) as pool:
+                results = pool.map(_computeNodes, tasks)
+        else:
+            #computed in this process, the profiler measures them directly
+            results = [([n.initializer.getWeights(n.dictionary) for n in group], {}) for group in groups]
+        for group, (weights, profile) in zip(groups, results):
+            Profiler.merge(profile)
+            for node, ws in zip(group, weights):
+                #weights saved by a worker are loaded from the cache by the nodes that need them
+                if ws is not None and node.consumers > 0: InitializerGraph.evaluated[node.key] = ws
+    
+    #compute the weights of the initializer, return them
+    def evaluate(self):
+        if self.root is None: return self.initializer.getWeights(self.dictionary)
+        InitializerGraph.running = True
+        try:
+            self.computeLeaves([n for n in self.order if not n.dependencies and n is not self.root])
+            for node in self.order:
+                if not node.dependencies and node is not self.root: continue
+                ws = node.initializer.getWeights(node.dictionary)
+                if node.consumers > 0: InitializerGraph.evaluated[node.key] = ws
+                #free weights no other node needs
+                for dependency in node.dependencies:
+                    dependency.consumers -= 1
+                    if dependency.consumers == 0: InitializerGraph.evaluated.pop(dependency.key, None)
+            return ws
+        finally:
+            InitializerGraph.running = False
+            InitializerGraph.evaluated = {}
         
         
         
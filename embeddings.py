@@ -0,0 +1,132 @@
+from common import *
+
+
+#index of all words of a fast text embeddings file - a sorted vocabulary to look words up, and their embeddings normalized to length 1
+#built once from the embeddings file, then memory mapped from cache files. Loading it reads almost nothing, lookups only touch the pages they need
+class FastTextIndex:
+    #utf-8 bytes of all words in sorted order, concatenated
+    words : np.ndarray
+    #start of every sorted word in words, with the total length at the end
+    offsets : np.ndarray
+    #row of every sorted word in vectors
+    rows : np.ndarray
+    #float32 embeddings normalized to length 1 (zero if the embedding was zero), in the order of the embeddings file
+    vectors : np.ndarray
+
+    def __init__(self, words : np.ndarray, offsets : np.ndarray, rows : np.ndarray, vectors : np.ndarray):
+        self.words = words
+        self.offsets = offsets
+        self.rows = rows
+        self.vectors = vectors
+        #hint embeddings of dictionaries, by the name and content hash of the dictionary
+        self.hint_embeddings = {}
+
+    @property
+    def word_count(self):
+        return len(self.rows)
+
+    #i-th word in the sorted order, as utf-8 bytes
+    def sortedWord(self, i : int):
+        return self.words[self.offsets[i]:self.offsets[i+1]].tobytes()
+
+    #row of the embedding of the word, None if there is no embedding for it. Binary search over the sorted words
+    def wordRow(self, word : str):
+        key = word.encode("utf-8")
+        lo, hi = 0, self.word_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.sortedWord(mid) < key: lo = mid + 1
+            else: hi = mid
+        return int(self.rows[lo]) if lo < self.word_count and self.sortedWord(lo) == key else None
+
+    #normalized embedding of the word, or of its lowercase version if the word itself is not in the index. None if neither of them is
+    def embedding(self, word : str):
+        row = self.wordRow(word)
+        if row is None and word != word.lower(): row = self.wordRow(word.lower())
+        return None if row is None else self.vectors[row]
+
+    #normalized float32 embeddings of all hint words of the dictionary, zero for hints without an embedding. Gathered once for every dictionary from the vectors of the index
+    def hintEmbeddings(self, dictionary : Dictionary):
+        key = (dictionary.name, dictionary.content_hash)
+        if key not in self.hint_embeddings:
+            rows = [self.wordRow(w) for w in dictionary.hint_words]
+            found = [i for i, r in enumerate(rows) if r is not None]
+            embeds = np.zeros((len(rows), self.vectors.shape[1]), dtype=np.float32)
+            #rows are gathered in sorted order, so reading them from the memory mapped vectors touches each page once
+            order = sorted(found, key=rows.__getitem__)
+            embeds[order] = self.vectors[[rows[i] for i in order]]
+            self.hint_embeddings[key] = embeds
+        return self.hint_embeddings[key]
+
+    #k dictionary hints nearest to the word by cosine similarity of their embeddings, exact - one matrix-vector product over all hint embeddings
+    #returns (hint indices, similarities), the nearest hint first. None if the word has no embedding
+    def nearestHints(self, word : str, dictionary : Dictionary, k = 5):
+        vector = self.embedding(word)
+        if vector is None: return None
+        similarities = self.hintEmbeddings(dictionary) @ vector
+        k = min(k, len(similarities))
+        nearest = np.argpartition(-similarities, k - 1)[:k]
+        nearest = nearest[np.argsort(-similarities[nearest])]
+        return nearest, similarities[nearest]
+
+    #read the embeddings file, save normalized vectors into fname_vectors.npy, and the sorted vocabulary into fname_words.bin, fname_offsets.npy and fname_rows.npy
+    #vectors are written block_lines lines at a time, the whole file is never held in memory. Lines that cannot be parsed get a zero vector
+    @staticmethod
+    def build(fast_text_file : str, fname : str, block_lines : int = 2**16):
+        words = []
+        with open(fast_text_file, 'rb') as fin:
+            n, d = map(int, fin.readline().split())
+            #the vectors file is created under a temporary name, and renamed once complete
+            vectors = np.lib.format.open_memmap(f"{fname}_vectors.npy.tmp", mode="w+", dtype=np.float32, shape=(n, d))
+            def parse(lines):
+                parts = [l.rstrip().partition(b' ') for l in lines]
+                words.extend(w.decode('utf-8', errors='ignore') for w, _, _ in parts)
+                try:
+                    block = np.array(b" ".join(e for _, _, e in parts).split(), dtype=np.float32).reshape(len(parts), d)
+                except ValueError:
+                    block = np.array([np.array(e.split(), dtype=np.float32) if len(e.split()) == d else np.zeros(d, dtype=np.float32) for _, _, e in parts])
+                lens = np.sqrt(np.sum(block * block, 1, keepdims=True))
+                vectors[len(words) - len(parts):len(words)] = block / np.where(lens > 0, lens, 1)
+            lines = []
+            for line in fin:
+                if len(words) + len(lines) >= n: break
+                lines.append(line)
+                if len(lines) == block_lines:
+                    parse(lines)
+                    lines = []
+            if lines: parse(lines)
+            vectors.flush()
+            del vectors
+        os.replace(f"{fname}_vectors.npy.tmp", f"{fname}_vectors.npy")
+
+        #words are sorted by their utf-8 bytes, so that they can be compared without decoding during lookups. The first of duplicate words is found
+        encoded = [w.encode("utf-8") for w in words]
+        rows = np.array(sorted(range(len(encoded)), key=encoded.__getitem__), dtype=np.int32)
+        offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(encoded[r]) for r in rows])
+        utils.atomic_write(f"{fname}_words.bin", lambda f: f.write(b"".join(encoded[r] for r in rows)))
+        utils.save_weights(f"{fname}_offsets.npy", offsets)
+        #rows are saved last - they mark the index as complete
+        utils.save_weights(f"{fname}_rows.npy", rows)
+
+    #load the index of the fast text file of the given language from cache files, build it if they do not exist. The name of the files contains a hash of the size and
+    #modification time of the embeddings file, so the index is rebuilt when it changes
+    _loaded = {}
+    @staticmethod
+    def load(language_settings : LanguageSettings):
+        fast_text_file = language_settings.fast_text_file
+        if fast_text_file not in FastTextIndex._loaded:
+            key = utils.hash_value((fast_text_file, utils.file_signature(fast_text_file)))
+            fname = os.path.join("data", "cache", f"fasttext_index_{language_settings.language}_{key[:16]}")
+            if not utils.file_exists(f"{fname}_rows.npy"):
+                print ("Building fast text index... ", end="", flush=True)
+                os.makedirs(os.path.dirname(fname), exist_ok=True)
+                FastTextIndex.build(fast_text_file, fname)
+                print ("Done.", flush=True)
+            FastTextIndex._loaded[fast_text_file] = FastTextIndex(np.memmap(f"{fname}_words.bin", dtype=np.uint8, mode='r'), *(np.load(f"{fname}_{f}.npy", mmap_mode='r') for f in ("offsets", "rows", "vectors")))
+        return FastTextIndex._loaded[fast_text_file]
+
+
+
+if __name__ == "__main__":
+    import main
@@ -1,7 +1,11 @@
 from players import Game
 from datasets import CombinedInitializer
+from profiling import Profiler
 
 
+#measure how long each phase of the game takes, print a report at the end
+#Profiler.enable()
+
 #let user define both teams
 game = Game.createGameInput(CombinedInitializer.DefaultInitializer())
 
@@ -11,3 +15,8 @@ game = Game.createGameInput(CombinedInitializer.DefaultInitializer())
 #play 1 game
 game.playRound()
 
+#print the profiler report, export it for other tools
+if Profiler.enabled:
+    Profiler.report()
+    #Profiler.exportJson("profile.json")
+    #Profiler.exportCsv("profile.csv")
@@ -1,4 +1,7 @@
-from board import Board
+from typing import List
+import collections
+import threading
+from board import Board, BoardBatch
 from common import *
 from datasets import ModelInitializer
 
@@ -12,16 +15,34 @@ from renderer import colored
 class Hint:
     word_i : int
     count : int
+    #hints that are not in the dictionary (given by a human) - (indices of the nearest dictionary hints, blend weights summing to 1). None for dictionary hints
+    neighbours : typing.Optional[typing.Tuple[np.ndarray, np.ndarray]]
     
-    #hinted cards are only given when debugging
-    def __init__(self, word_i, count, hinted_cards=None):
+    #hinted cards are only given when debugging. dictionary is the one the hint index points into, the current context dictionary if not given
+    #for a hint that is not in the dictionary, text is the hint itself, and word_i is its nearest dictionary hint
+    def __init__(self, word_i, count, hinted_cards=None, dictionary : Dictionary = None, neighbours = None, text : typing.Optional[str] = None):
         self.word_i = word_i
         self.count = count
         self.hinted_cards = hinted_cards
+        self.dictionary = dictionary
+        self.neighbours = neighbours
+        self.text = text
     
     @property
     def word(self):
-        return dictionary.hintWord(self.word_i)
+        if self.text is not None: return self.text
+        return (self.dictionary if self.dictionary is not None else Context.current().dictionary).hintWord(self.word_i)
+    
+    #hint outside of the dictionary, guessed using the weights of its nearest dictionary hints, weighted by their similarities. Hints with a similarity <= 0 are not used
+    #returns None if the word has no embedding, or is not similar to any dictionary hint
+    @staticmethod
+    def fromNeighbours(text : str, count : int, nearest : typing.Optional[typing.Tuple[np.ndarray, np.ndarray]], dictionary : Dictionary = None):
+        if nearest is None: return None
+        indices, similarities = nearest
+        used = similarities > 0
+        if not np.any(used): return None
+        blend = similarities[used] / similarities[used].sum()
+        return Hint(int(indices[0]), count, dictionary=dictionary, neighbours=(indices[used], blend), text=text)
     
     @staticmethod
     def Invalid():
@@ -40,64 +61,509 @@ class Hint:
 #a model with weights
 class Model:
     weights : np.ndarray
+    #dictionary the weights were computed for
+    dictionary : Dictionary
 
-    def __init__(self, initializer : ModelInitializer):
-        self.weights = initializer.getWeights()
+    #dtype - precision of the weights (e.g. np.float32 or np.float16), all computations with them are done in it
+    def __init__(self, initializer : ModelInitializer, dictionary : Dictionary = None, dtype = np.float64):
+        self.dictionary = dictionary if dictionary is not None else Context.current().dictionary
+        self.weights = initializer.getDenseWeights(self.dictionary, dtype)
 
 
 #AI agent model
 class AgentModel (Model):
+    #weights in the hint-major layout (hint words, board words) - weights of all board words for one hint are next to each other in memory
+    hint_weights : np.ndarray
+    
     #random chance - chance to select a random option weighted by softmax of all weights instead of the best one
-    def __init__(self, initializer : ModelInitializer, random_chance = 0.0):
-        super().__init__(initializer)
+    def __init__(self, initializer : ModelInitializer, random_chance = 0.0, dictionary : Dictionary = None, dtype = np.float64):
+        super().__init__(initializer, dictionary, dtype)
+        self.hint_weights = initializer.getDenseWeights(self.dictionary, dtype, hint_major=True)
         self.random_chance = random_chance
 
+    #weights of the given board words for the hint. A hint outside of the dictionary uses the blend of the weights of its nearest dictionary hints
+    def hintWordWeights(self, hint : Hint, word_idx : np.ndarray):
+        if hint.neighbours is None: return self.hint_weights[hint.word_i, word_idx]
+        indices, blend = hint.neighbours
+        return blend.astype(self.hint_weights.dtype) @ self.hint_weights[indices[:, None], word_idx]
+
+    #guess a card for the given hint. If board is a BoardBatch or a list of boards, hint is a list with one hint for every board, and an array of guesses is returned
+    @Profiler.timed("agent_guess")
     def guess(self, board : Board, hint : Hint):
-        #get weights for the given hint and all the words on board
-        word_weights = board.getWeights(self.weights, -np.inf)[:, hint.word_i]
+        if isinstance(board, list): board = BoardBatch.fromBoards(board)
+        if isinstance(board, BoardBatch):
+            #gather weights of all board cards for the hint of each board, revealed cards cannot be guessed
+            word_weights = self.hint_weights[np.array([h.word_i for h in hint])[:, None], board.word_idx]
+            #hints outside of the dictionary blend the weights of their nearest dictionary hints
+            for i, h in enumerate(hint):
+                if h.neighbours is not None: word_weights[i] = self.hintWordWeights(h, board.word_idx[i])
+            word_weights = np.where(board.hidden, word_weights, -np.inf)
+            guesses = np.argmax(word_weights, 1)
+            #some boards guess at random, based on the softmax of their weights
+            for i in np.flatnonzero(np.random.random(board.batch_size) < self.random_chance):
+                guesses[i] = np.random.choice(np.arange(board.size), p=softmax(word_weights[i]))
+            return guesses
+        #get weights for the given hint and all the words on board - one gather from the row of the hint, revealed cards cannot be guessed
+        word_weights = np.where(board.hidden, self.hintWordWeights(hint, board.word_idx), -np.inf)
         #select random weight based on the softmax of all with a chance self.random_chance. else select the best one
         if random.random() < self.random_chance:
-            return np.random.choice(np.arange(self.board.size), p=softmax(word_weights))
+            return np.random.choice(np.arange(board.size), p=softmax(word_weights))
         else:
             return np.argmax(word_weights)
 
 
+#bounded LRU cache of hints, keyed by the board state. Can be shared by more threads in one process
+class HintCache:
+    #max_bytes - approximate memory the cached keys and hints may take, least recently used hints are removed above it
+    def __init__(self, max_bytes = 2**26):
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+    
+    #approximate memory taken by one entry - key bytes and python object overhead
+    ENTRY_OVERHEAD = 512
+    
+    #canonical state of a board for the given team - hidden words sorted with their roles, and disabled hints. Revealed cards and card order do not change the hint
+    @staticmethod
+    def key(team : int, word_idx : np.ndarray, roles : np.ndarray, hidden : np.ndarray, disabled_hints : np.ndarray):
+        words = word_idx[hidden]
+        order = np.argsort(words)
+        return int(team), words[order].astype(np.int32).tobytes(), roles[hidden][order].astype(np.int8).tobytes(), np.packbits(disabled_hints).tobytes()
+    
+    @staticmethod
+    def boardKey(team : int, board : Board):
+        return HintCache.key(team, board.word_idx, board.roles, board.hidden, board.disabled_hints)
+    
+    #return the cached hint for the key and mark it as recently used, None if it is not cached
+    def get(self, key):
+        with self.lock:
+            hint = self.entries.get(key)
+            if hint is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return hint
+    
+    #cache a hint, remove least recently used ones if the cache is too large
+    def put(self, key, hint : Hint):
+        with self.lock:
+            if key in self.entries: return
+            self.entries[key] = hint
+            self.bytes += HintCache.entrySize(key)
+            while self.bytes > self.max_bytes and self.entries:
+                old_key, _ = self.entries.popitem(last=False)
+                self.bytes -= HintCache.entrySize(old_key)
+    
+    @staticmethod
+    def entrySize(key):
+        return sum(len(k) for k in key[1:]) + HintCache.ENTRY_OVERHEAD
+    
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+    
+    def __len__(self):
+        return len(self.entries)
+    
+    @property
+    def hit_rate(self):
+        return self.hits / max(self.hits + self.misses, 1)
+    
+    def __str__(self):
+        return f"Hint cache: {len(self)} hints, {self.bytes} bytes, hits: {self.hits}, misses: {self.misses}, hit rate: {self.hit_rate:.4f}"
+
+
+#inverted index from every board word to the hints with its largest weights. A hint can only score more than 0 if it has a positive weight for a hidden card
+#of the captain's team, so a captain only has to consider the candidates of these cards. Assumes all weights are >= 0, like the ones of all initializers
+class CandidateIndex:
+    #hint indices of every board word (board words, size), sorted by weight from the largest one. -1 where a board word has fewer positive weights
+    hints : np.ndarray
+    #true if every positive weight is in the index - candidates then give the same hints as searching all of them
+    complete : bool
+
+    def __init__(self, hints : np.ndarray, complete : bool):
+        self.hints = hints
+        self.complete = complete
+
+    #build the index of the given size for the weights, they are processed block_size values at a time
+    @staticmethod
+    def build(weights, size : int, block_size : int = 2**24):
+        size = min(size, weights.shape[1])
+        hints = np.full([weights.shape[0], size], -1, dtype=np.int32)
+        complete = True
+        rows = max(1, block_size // weights.shape[1])
+        for start in range(0, weights.shape[0], rows):
+            block = np.asarray(weights[start:start + rows])
+            top = np.argpartition(-block, size - 1, 1)[:, :size] if size < block.shape[1] else np.broadcast_to(np.arange(size), block.shape)
+            top_weights = np.take_along_axis(block, top, 1)
+            order = np.argsort(-top_weights, 1, kind="stable")
+            hints[start:start + len(block)] = np.where(np.take_along_axis(top_weights, order, 1) > 0, np.take_along_axis(top, order, 1), -1)
+            complete &= bool(np.all(np.count_nonzero(block > 0, 1) <= size))
+        return CandidateIndex(hints, complete)
+
+    #index of the given size for the weights of the initializer. If the weights are cached, the index is cached next to them (for every size and dtype of the weights),
+    #built only once and memory mapped afterwards. Models of the same initializer in one process share it
+    _loaded = {}
+    @staticmethod
+    def load(initializer : ModelInitializer, dictionary : Dictionary, weights, size : int):
+        weights_filename = initializer.cacheFilename(dictionary)
+        if weights_filename is None: return CandidateIndex.build(weights, size)
+        fname = os.path.splitext(weights_filename)[0] + ("" if weights.dtype == np.float64 else f"_{weights.dtype.name}") + f"_candidates_{size}"
+        if fname not in CandidateIndex._loaded:
+            if not utils.file_exists(f"{fname}_hints.npy"):
+                index = CandidateIndex.build(weights, size)
+                #hints are saved last - they mark the index as complete
+                utils.save_weights(f"{fname}_complete.npy", np.array(index.complete))
+                utils.save_weights(f"{fname}_hints.npy", index.hints)
+            CandidateIndex._loaded[fname] = CandidateIndex(np.load(f"{fname}_hints.npy", mmap_mode='r'), bool(np.load(f"{fname}_complete.npy")))
+        return CandidateIndex._loaded[fname]
+
+    #sorted candidate hints of the given board words - all hints in the index of at least one of them
+    def candidates(self, word_idx : np.ndarray):
+        hints = self.hints[word_idx].ravel()
+        return np.unique(hints[hints >= 0]).astype(np.intp)
+
+    #smallest size of a complete index for the weights - the largest number of positive weights of one board word
+    @staticmethod
+    def completeSize(weights):
+        return int(np.max(np.count_nonzero(np.asarray(weights) > 0, 1)))
+
+
+#hint state of one team's captain during one game. Cards are sorted for every hint only once, when the state is created. The board then notifies the state
+#about revealed cards and disabled hints, which only zero the affected card scores - later hints just sum the scores again, nothing is gathered or sorted
+class CaptainState:
+    def __init__(self, model : "CaptainModel", team : int, board : Board):
+        self.model = model
+        self.team = team
+        #if the model has a candidate index, only candidate hints of the cards of the team are kept. Revealing cards only removes candidates, so they stay valid for the whole game
+        self.hint_idx = model.candidate_index.candidates(board.word_idx[board.hidden & (board.getScores(team) > 0)]) if model.candidate_index is not None else None
+        #hint-major layout (hints, cards) for sorting, same as in CaptainModel.bestHints
+        word_weights = np.ascontiguousarray(board.getCaptainWeights(model.weights, 0.0, self.hint_idx).T)
+        #cards sorted by weight for every hint, and the position of every card in that order. Positions are small, they are kept in the smallest integer type possible
+        #cards with the same weight are ordered the same way as in CaptainModel.bestHints, so ties give the same hints
+        index_type = np.min_scalar_type(board.size)
+        sorted_indices = CaptainModel.sortCards(word_weights).astype(index_type)
+        #the state is kept in a position-major layout (positions, hints) - cumulative sums over positions then add whole rows of all hints at once,
+        #instead of summing 25 values at a time for every hint. sorted_indices[p, h] is the p-th card of hint h, positions[c, h] is the position of card c in hint h
+        self.sorted_indices = np.ascontiguousarray(sorted_indices.T)
+        self.positions = np.empty_like(self.sorted_indices)
+        np.put_along_axis(self.positions, self.sorted_indices, np.arange(board.size, dtype=index_type)[:, None], 0)
+        #score of every sorted card for every hint. Revealed cards and disabled hints score 0
+        card_scores = np.take_along_axis(word_weights, sorted_indices, 1)
+        card_scores *= board.getScores(team).astype(word_weights.dtype)[sorted_indices]
+        self.card_scores = np.ascontiguousarray(card_scores.T)
+        #false for revealed cards - they keep their place in the order, but are never counted in a hint
+        self.selectable = board.hidden[self.sorted_indices]
+        #cumulative sums of card scores, computed again on the next hint when updated is false
+        self.hint_scores = np.empty_like(self.card_scores)
+        self.updated = False
+
+    #called by the board when a card is revealed
+    def onReveal(self, card_i : int):
+        hints, positions = np.arange(self.positions.shape[1]), self.positions[card_i]
+        self.card_scores[positions, hints] = 0
+        self.selectable[positions, hints] = False
+        self.updated = False
+
+    #called by the board when a hint is disabled
+    def onDisableHint(self, hint_i : int):
+        if self.hint_idx is not None:
+            #position of the hint among the candidates, nothing changes if it is not one of them
+            position = int(np.searchsorted(self.hint_idx, hint_i))
+            if position == len(self.hint_idx) or self.hint_idx[position] != hint_i: return
+            hint_i = position
+        self.card_scores[:, hint_i] = 0
+        self.updated = False
+
+    #the best hint for the current state of the board - the same one CaptainModel.bestHints would give. Revealed cards keep their place in the order, but hidden cards stay
+    #in the same order as when sorting them again, and revealed ones would score 0 there. Hints of both "score" and "topk" modes are the same, so the mode does not matter here
+    def bestHint(self, board : Board) -> Hint:
+        if self.hint_idx is not None and len(self.hint_idx) == 0: return self.bestDenseHint(board)
+        if not self.updated:
+            #cumulative sums row by row - np.cumsum over the first axis goes through one hint at a time, adding whole rows is a lot faster
+            self.hint_scores[0] = self.card_scores[0]
+            for position in range(1, len(self.card_scores)):
+                np.add(self.hint_scores[position - 1], self.card_scores[position], out=self.hint_scores[position])
+            self.updated = True
+        #best score of every hint. The first hint with the best score and its first position with it are taken, like in CaptainModel.bestHints
+        #revealed cards score 0, the cumulative score at them is the same as at the card before. So if a hint scores more than 0, it reaches its best score at a hidden card first,
+        #revealed cards have to be masked out only when no hint scores more than 0
+        hint_scores = self.hint_scores
+        best_scores = np.max(hint_scores, 0)
+        if np.max(best_scores) <= 0:
+            #no candidate hint scores more than 0 - any hint could be the best one, search all of them
+            if self.hint_idx is not None: return self.bestDenseHint(board)
+            hint_scores = np.where(self.selectable, hint_scores, -np.inf)
+            best_scores = np.max(hint_scores, 0)
+        hint_i = int(np.argmax(best_scores))
+        position = int(np.argmax(hint_scores[:, hint_i]))
+        #count only hidden cards up to the best position
+        count = int(np.count_nonzero(self.selectable[:position+1, hint_i]))
+        hinted_cards = [board.getCard(i) for i in self.sorted_indices[:, hint_i][self.selectable[:, hint_i]][:count]] if self.model.reveal_hinted else None
+        return Hint(hint_i if self.hint_idx is None else int(self.hint_idx[hint_i]), count, hinted_cards, self.model.dictionary)
+
+    #the best hint searching all hints, without the state
+    def bestDenseHint(self, board : Board) -> Hint:
+        return self.model.bestHints(board.getCaptainWeights(self.model.weights, 0.0)[None], board.getScores(self.team)[None], lambda b: board)[0]
+
+
 #AI captain model
 class CaptainModel (Model):
-    def __init__(self, initializer : ModelInitializer, hint_mode = "score", reveal_hinted=False):
-        super().__init__(initializer)
+    #hint modes - "score" sorts all cards for every hint, "topk" gives the same hints, but prunes hints that cannot be the best ones and sorts only top_k cards for the rest
+    HINT_MODES = ("score", "topk")
+    #number of hints scored exactly for the lower bound of the "topk" mode, on every board
+    TOPK_EXACT_HINTS = 32
+    #max. size in bytes of temporary arrays of one chunk, when giving hints for many boards at once. Batching does not make hints faster per board - every board needs its own
+    #sorting work for every hint, nothing is shared between boards. It only saves the per-call overhead, which matters for small dictionaries. Chunks that fit into the CPU cache are
+    #the fastest (the temporary arrays are reused between chunks), with 10k hint words one board already needs more (about 8 MB), and every chunk is a single board
+    CHUNK_BYTES = 2**22
+    
+    #dtype - precision of the weights, hints are computed in it. Lower precision halves (np.float32) or quarters (np.float16) the memory sorted for every hint
+    #incremental - if true, hints for single boards are given using a CaptainState kept for the whole game, cards are then sorted only on the first turn of each team
+    #cache_bytes - if larger than 0, given hints are kept in a HintCache of this size, and the same board states get the cached hint without computing it again
+    #candidate_hints - if larger than 0, a CandidateIndex of this many hints per board word is used (built once and cached next to the weights), and only candidate hints of the cards on board are scored. Needed for large hint vocabularies
+    #verify_candidates - also search all hints, and check that the hints are the same as the candidate ones whenever the candidate index is complete. Slow, for testing only. The incremental state is not used then
+    def __init__(self, initializer : ModelInitializer, hint_mode = "score", reveal_hinted=False, dtype = np.float64, top_k = 5, dictionary : Dictionary = None, incremental = True, cache_bytes = 0, candidate_hints = 0, verify_candidates = False):
+        super().__init__(initializer, dictionary, dtype)
+        self.candidate_index = CandidateIndex.load(initializer, self.dictionary, self.weights, candidate_hints) if candidate_hints > 0 else None
+        self.verify_candidates = verify_candidates and self.candidate_index is not None
+        self.incremental = incremental and not self.verify_candidates
+        self.hint_cache = HintCache(cache_bytes) if cache_bytes > 0 else None
         self.hint_mode = hint_mode
+        self.top_k = top_k
         self.reveal_hinted=reveal_hinted
+        #temporary arrays of the batched hints, kept between chunks. New arrays this large are allocated straight from the OS, and every page of them is faulted in again on every chunk
+        #every thread has its own buffers, a model can be shared by more threads
+        self.scratch_buffers = threading.local()
 
-    #give a hint for the given team
+    #give a hint for the given team. If board is a BoardBatch, team can be an array with one team per board, and a list with one hint for every board is returned
+    @Profiler.timed("captain_hint")
     def giveHint(self, team : int, board : Board) -> Hint:
-        word_weights = board.getCaptainWeights(self.weights, 0.0)
-        if self.hint_mode == "score":
-            #we assume agent will pick the words from the most probable one to the least probable one - get the indices of sorted array, separately for each hint
-            sorted_indices = np.argsort(word_weights, 0)[::-1]
-            
-            
-            #get sorted weights
-            sorted_ws = np.take_along_axis(word_weights, sorted_indices, 0)
-           
-            #get scores for all board cards, sort it in the same way as sorted weights for each hint
-            scores = np.broadcast_to(np.expand_dims(board.getScores(team), 1), word_weights.shape)
-            sorted_scores = np.take_along_axis(scores, sorted_indices, 0)
-            
-            #compute score for every word in the sorted array
-            individual_hint_scores = sorted_ws * sorted_scores
-            #user will take from the most probable one - take the cumulative sum to represent all words selected after a given hint
-            hint_scores = np.cumsum(individual_hint_scores, 0)
-            
-            #find the index of the best hint, decompose it into hint index and count
-            best_hint = np.unravel_index(np.argmax(hint_scores), hint_scores.shape)
-            #return the found hint, including the words I am hinting at if reveal hinted is true
-            return Hint(best_hint[1], best_hint[0] + 1, [board.getCard(i) for i in sorted_indices[:best_hint[0]+1, best_hint[1]]] if self.reveal_hinted else None)
-        else:
+        if isinstance(board, BoardBatch): return self.giveHints(team, board)
+        if self.hint_mode not in CaptainModel.HINT_MODES:
             print("Invalid hint mode.")
             return Hint.Invalid()
+        if self.hint_cache is not None:
+            key = HintCache.boardKey(team, board)
+            hint = self.hint_cache.get(key)
+            if hint is None:
+                hint = self.computeHint(team, board)
+                self.hint_cache.put(key, hint)
+            return hint
+        return self.computeHint(team, board)
+    
+    #compute a hint for a single board, without using the cache
+    def computeHint(self, team : int, board : Board) -> Hint:
+        if self.incremental: return self.captainState(team, board).bestHint(board)
+        if self.candidate_index is not None:
+            hint = self.bestCandidateHints(board.word_idx[None], board.hidden[None], board.disabled_hints[None], board.getScores(team)[None], lambda b: board)[0]
+            if self.verify_candidates: self.verifyHints([hint], board.getCaptainWeights(self.weights, 0.0)[None], board.getScores(team)[None], lambda b: board)
+            return hint
+        return self.bestHints(board.getCaptainWeights(self.weights, 0.0)[None], board.getScores(team)[None], lambda b: board)[0]
+
+    #reusable temporary array of the given shape and dtype, at most one buffer of every name is kept for each thread. Its contents are undefined
+    def scratch(self, name : str, shape, dtype) -> np.ndarray:
+        size = int(np.prod(shape))
+        if not hasattr(self.scratch_buffers, "buffers"): self.scratch_buffers.buffers = {}
+        buffers = self.scratch_buffers.buffers
+        buffer = buffers.get(name)
+        if buffer is None or buffer.dtype != dtype or buffer.size < size:
+            buffer = buffers[name] = np.empty(size, dtype)
+        return buffer[:size].reshape(shape)
+
+    #state of the given team on the given board. Created on the first hint, the board keeps it updated afterwards
+    def captainState(self, team : int, board : Board) -> CaptainState:
+        for l in board.listeners:
+            if isinstance(l, CaptainState) and l.model is self and l.team == team: return l
+        state = CaptainState(self, team, board)
+        board.listeners.append(state)
+        return state
+
+    #give hints for many boards at once. boards is a BoardBatch or a list of boards, teams is one team for all of them or an array with one team per board
+    @Profiler.timed("captain_hints_batch")
+    def giveHints(self, teams, boards) -> List[Hint]:
+        if not isinstance(boards, BoardBatch): boards = BoardBatch.fromBoards(boards)
+        if self.hint_mode not in CaptainModel.HINT_MODES:
+            print("Invalid hint mode.")
+            return [Hint.Invalid() for _ in range(boards.batch_size)]
+        teams = np.broadcast_to(teams, [boards.batch_size])
+        if self.hint_cache is None: return self.computeHints(teams, boards)
+        #compute hints only for boards whose state is not cached
+        keys = [HintCache.key(teams[i], boards.word_idx[i], boards.roles[i], boards.hidden[i], boards.disabled_hints[i]) for i in range(boards.batch_size)]
+        hints = [self.hint_cache.get(k) for k in keys]
+        missing = np.array([i for i, h in enumerate(hints) if h is None], dtype=np.intp)
+        if len(missing) > 0:
+            missing_boards = BoardBatch(boards.word_idx[missing], boards.roles[missing], boards.hidden[missing], boards.disabled_hints[missing], boards.context)
+            for i, hint in zip(missing, self.computeHints(teams[missing], missing_boards)):
+                hints[i] = hint
+                self.hint_cache.put(keys[i], hint)
+        return hints
+
+    #compute hints for a BoardBatch, without using the cache. teams is an array with one team per board
+    def computeHints(self, teams, boards : BoardBatch) -> List[Hint]:
+        #temporary memory per board - gathered weights, their products with scores, the sorted products and the sorted indices
+        board_memory = boards.size * self.weights.shape[1] * (3 * self.weights.itemsize + np.dtype(np.int64).itemsize)
+        chunk = max(1, CaptainModel.CHUNK_BYTES // board_memory)
+        scores = boards.getScores(teams)
+        hints = []
+        for start in range(0, boards.batch_size, chunk):
+            part = slice(start, start + chunk)
+            chunk_boards = BoardBatch(boards.word_idx[part], boards.roles[part], boards.hidden[part], boards.disabled_hints[part], boards.context)
+            if self.candidate_index is None:
+                word_weights = self.scratch("word_weights", (chunk_boards.batch_size, chunk_boards.size, self.weights.shape[1]), self.weights.dtype)
+                hints += self.bestHints(chunk_boards.getCaptainWeights(self.weights, 0.0, word_weights), scores[part], chunk_boards.getBoard)
+                continue
+            chunk_hints = self.bestCandidateHints(chunk_boards.word_idx, chunk_boards.hidden, chunk_boards.disabled_hints, scores[part], chunk_boards.getBoard)
+            if self.verify_candidates: self.verifyHints(chunk_hints, chunk_boards.getCaptainWeights(self.weights, 0.0), scores[part], chunk_boards.getBoard)
+            hints += chunk_hints
+        return hints
+
+    #best hints using the candidate index - only the candidate hints of the hidden cards with a positive score are scored on every board, other hints cannot score more than 0
+    #word_idx, hidden, disabled_hints and scores have one row for every board. Boards where no candidate scores more than 0 are searched densely
+    def bestCandidateHints(self, word_idx, hidden, disabled_hints, scores, getBoard) -> List[Hint]:
+        candidates = [self.candidate_index.candidates(word_idx[b][hidden[b] & (scores[b] > 0)]) for b in range(len(word_idx))]
+        #candidates of all boards padded to the same count. Padding columns have zero weights, they never score more than 0
+        hint_idx = np.zeros([len(candidates), max(1, max(len(c) for c in candidates))], dtype=np.intp)
+        valid = np.zeros(hint_idx.shape, dtype=bool)
+        for b, c in enumerate(candidates):
+            hint_idx[b, :len(c)] = c
+            valid[b, :len(c)] = True
+        #(boards, cards, candidates) weights, the same as the dense ones for the candidate hints. Candidates are sorted, so ties are resolved by the hint index like in the dense search
+        word_weights = self.weights[word_idx[:, :, None], hint_idx[:, None, :]]
+        word_weights[~hidden] = 0.0
+        word_weights[np.broadcast_to((np.take_along_axis(disabled_hints, hint_idx, 1) | ~valid)[:, None, :], word_weights.shape)] = 0.0
+        hints = self.bestHints(word_weights, scores, getBoard)
+        for b, hint in enumerate(hints):
+            #score of the found hint - cumulative scores of its cards sorted by weight, the same way bestHints sorts them
+            ws = word_weights[b, :, hint.word_i]
+            order = np.argsort(-ws, kind="stable")
+            if np.max(np.cumsum(ws[order] * scores[b, order])) > 0:
+                hint.word_i = int(hint_idx[b, hint.word_i])
+            else:
+                weights = self.weights[word_idx[b]]
+                weights[~hidden[b]] = 0.0
+                weights[:, disabled_hints[b]] = 0.0
+                hints[b] = self.bestHints(weights[None], scores[b][None], lambda _: getBoard(b))[0]
+        return hints
+
+    #check that the hints are the same as the ones found by searching all hints. Differences are only possible if the candidate index is not complete
+    def verifyHints(self, hints : List[Hint], word_weights, scores, getBoard):
+        if not self.candidate_index.complete: return
+        for hint, dense in zip(hints, self.bestHints(word_weights, scores, getBoard)):
+            if (hint.word_i, hint.count) != (dense.word_i, dense.count):
+                raise RuntimeError(f"Candidate hint {hint.word_i} {hint.count} differs from the dense hint {dense.word_i} {dense.count}")
+
+    #find the best hint for every board. word_weights have the shape (boards, cards, hints), scores (boards, cards). getBoard(i) returns the i-th board, it is used when revealing hinted cards
+    def bestHints(self, word_weights, scores, getBoard) -> List[Hint]:
+        if self.hint_mode == "topk": return self.bestHintsTopK(word_weights, scores, getBoard)
+        #use a hint-major layout (boards, hints, cards), so that all cards for one hint are next to each other in memory. Arrays computed from the transposed view get this layout without copying the weights
+        word_weights = word_weights.transpose(0, 2, 1)
+        #we assume agent will pick the words from the most probable one to the least probable one - get the indices of sorted array, separately for each hint
+        sorted_indices = CaptainModel.sortCards(word_weights)
+        
+        #multiply weights by scores of their cards, then sort the products - one gather instead of gathering both weights and scores
+        hint_scores = word_weights * scores.astype(word_weights.dtype)[:, None, :]
+        hint_scores = np.take_along_axis(hint_scores, sorted_indices, 2)
+        #user will take from the most probable one - take the cumulative sum to represent all words selected after a given hint
+        np.cumsum(hint_scores, 2, out=hint_scores)
+        
+        #find the index of the best hint for every board, decompose it into hint index and count
+        hint_indices, counts = np.unravel_index(np.argmax(hint_scores.reshape(hint_scores.shape[0], -1), 1), hint_scores.shape[1:])
+        #return the found hints, including the words I am hinting at if reveal hinted is true
+        hints = []
+        for b, (hint_i, count) in enumerate(zip(hint_indices, counts)):
+            hinted_cards = [getBoard(b).getCard(i) for i in sorted_indices[b, hint_i, :count+1]] if self.reveal_hinted else None
+            hints.append(Hint(hint_i, count + 1, hinted_cards, self.dictionary))
+        return hints
+
+    #indices that sort the cards (the last axis) from the highest weight to the lowest, cards with the same weight stay in their order
+    #weights of up to 32 bits are packed together with their card index into int64 keys, which sort a lot faster than an argsort of the weights
+    @staticmethod
+    def sortCards(weights):
+        if weights.dtype.itemsize > 4 or weights.shape[-1] > 0x100: return np.argsort(-weights, -1, kind="stable")
+        #bits of a float32 as an int32 sort in the same order as the floats, after the bits of negative numbers are reversed. Adding 0 turns -0.0 into 0.0
+        bits = (weights + np.float32(0)).astype(np.float32).view(np.int32)
+        keys = (bits ^ ((bits >> 31) & 0x7fffffff)).astype(np.int64)
+        np.negative(keys, out=keys)
+        keys <<= 8
+        keys |= np.arange(weights.shape[-1])
+        keys.sort(-1)
+        keys &= 0xff
+        return keys
+
+    #same results as bestHints in the "score" mode. Hints whose score cannot beat the exact score of the most promising hints are pruned first, then only the top k cards are sorted for the remaining ones
+    def bestHintsTopK(self, word_weights, scores, getBoard) -> List[Hint]:
+        scores = scores.astype(word_weights.dtype)
+        card_count = word_weights.shape[1]
+        #bounds are computed in the card-major layout (boards, cards, hints), all reductions over cards are then vectorized over hints
+        #score of each card for each hint. No prefix of sorted cards can score more than the sum of all positive ones
+        card_scores = np.multiply(word_weights, scores[:, :, None], out=self.scratch("card_scores", word_weights.shape, word_weights.dtype))
+        positive = np.maximum(card_scores, 0, out=self.scratch("positive", word_weights.shape, word_weights.dtype))
+        upper_bound = np.sum(positive, 1)
+        #the best hint scores at least as much as any other hint. Exact scores of a few hints with the largest upper bounds (all their cards sorted) are a lower bound
+        #that prunes almost all hints even when nearly all weights are positive - a bound from single cards would keep most of them
+        exact_count = min(CaptainModel.TOPK_EXACT_HINTS, word_weights.shape[2])
+        exact_hints = np.argpartition(-upper_bound, exact_count - 1, 1)[:, :exact_count]
+        exact_weights = np.take_along_axis(word_weights, exact_hints[:, None, :], 2).transpose(0, 2, 1)
+        exact_scores = np.take_along_axis(exact_weights * scores[:, None, :], CaptainModel.sortCards(exact_weights), 2)
+        lower_bound = np.max(np.cumsum(exact_scores, 2), (1, 2))
+        #keep only hints that could beat the lower bound. Small tolerance makes sure rounding errors never prune the best hint
+        board_i, hint_i = np.nonzero(upper_bound * (1 + 1e-6) + 1e-9 >= lower_bound[:, None])
+        candidates = word_weights[board_i, :, hint_i]
+        candidates_positive = positive[board_i, :, hint_i]
+        
+        #sort only k most probable cards for every remaining hint, compute cumulative scores for them. Cards with the same weight are taken in the same order as in the "score" mode
+        k = min(self.top_k, card_count)
+        top_indices = np.argpartition(-candidates, k - 1, 1)[:, :k]
+        top_weights = np.take_along_axis(candidates, top_indices, 1)
+        if k < card_count:
+            #if more cards than k have at least the weight of the k-th one, a card with a lower index could be left out - these hints sort all cards
+            #cards with weight 0 score 0, it does not matter which ones are taken
+            ties = (top_weights[:, k-1] > 0) & (np.count_nonzero(candidates >= top_weights[:, k-1:k], 1) > k)
+            if np.any(ties):
+                top_indices[ties] = CaptainModel.sortCards(candidates[ties])[:, :k]
+                top_weights[ties] = np.take_along_axis(candidates[ties], top_indices[ties], 1)
+        order = np.argsort(-top_weights, 1, kind="stable")
+        top_indices, top_weights = np.take_along_axis(top_indices, order, 1), np.take_along_axis(top_weights, order, 1)
+        #cards with the same positive weight are sorted by their index
+        ties = np.any((top_weights[:, 1:] == top_weights[:, :-1]) & (top_weights[:, 1:] > 0), 1)
+        if np.any(ties):
+            order = np.argsort(top_indices[ties], 1)
+            order = np.take_along_axis(order, np.argsort(-np.take_along_axis(top_weights[ties], order, 1), 1, kind="stable"), 1)
+            top_indices[ties] = np.take_along_axis(top_indices[ties], order, 1)
+        hint_scores = np.cumsum(top_weights * scores[board_i[:, None], top_indices], 1)
+        best_counts = np.argmax(hint_scores, 1)
+        best_scores = hint_scores[np.arange(len(board_i)), best_counts]
+        sorted_cards = list(top_indices)
+        
+        #taking more than k cards could still be better if the positive scores of cards outside top k are large enough - sort all cards for these hints
+        if k < card_count:
+            board_best = np.full(word_weights.shape[0], -np.inf, dtype=word_weights.dtype)
+            np.maximum.at(board_best, board_i, best_scores)
+            longer_bound = hint_scores[:, -1] + np.sum(candidates_positive, 1) - np.sum(np.take_along_axis(candidates_positive, top_indices, 1), 1)
+            for c in np.flatnonzero(longer_bound * (1 + 1e-6) + 1e-9 >= board_best[board_i]):
+                order = np.argsort(-candidates[c], kind="stable")
+                full_scores = np.cumsum(candidates[c, order] * scores[board_i[c], order])
+                best_counts[c] = np.argmax(full_scores)
+                best_scores[c] = full_scores[best_counts[c]]
+                sorted_cards[c] = order
         
+        #for every board, take the first of its hints with the best score - hints are ordered by board, then by hint index, same as in the "score" mode
+        board_best = np.full(word_weights.shape[0], -np.inf, dtype=word_weights.dtype)
+        np.maximum.at(board_best, board_i, best_scores)
+        best_rows = np.flatnonzero(best_scores == board_best[board_i])
+        best_rows = best_rows[np.unique(board_i[best_rows], return_index=True)[1]]
+        hints = []
+        for b, c in enumerate(best_rows):
+            hinted_cards = [getBoard(b).getCard(i) for i in sorted_cards[c][:best_counts[c]+1]] if self.reveal_hinted else None
+            hints.append(Hint(hint_i[c], best_counts[c] + 1, hinted_cards, self.dictionary))
+        return hints
 
 
 if __name__ == '__main__':
-    import main
\ No newline at end of file
+    import main
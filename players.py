@@ -3,22 +3,24 @@ from common import *
 
 from board import Board
 from model import AgentModel, CaptainModel, Hint
+from embeddings import FastTextIndex
 from renderer import ConsoleRenderer, colored, clear
 
 
 class CaptainPlayer:
     team : int = UNKNOWN
     
-    #play turn = give one hint
-    def playTurn(self, board : Board, team : int):
-        print (f"Current turn: {colored('Captain', team)}")
+    #play turn = give one hint. If quiet, nothing is printed and the player does not wait for enter (used by simulations)
+    def playTurn(self, board : Board, team : int, quiet = False):
+        if not quiet: print (f"Current turn: {colored('Captain', team)}")
         #give hint will be overriden for all types of players (AI or human)
         hint = self.giveHint(board, team)
-        #disable given hint - it cannot be said again
-        board.disableHint(hint.word_i)
-        print (f"Given hint: {hint.colored(team)}")
-        #when user presses enter, clear the screen. Agent will play next
-        press_enter_clear()
+        #disable given hint - it cannot be said again. Hints outside of the dictionary cannot be given by AI captains anyway
+        if hint.neighbours is None: board.disableHint(hint.word_i)
+        if not quiet:
+            print (f"Given hint: {hint.colored(team)}")
+            #when user presses enter, clear the screen. Agent will play next
+            press_enter_clear()
         return hint
     
     #will be overriden by all child classes
@@ -38,20 +40,29 @@ class AICaptainPlayer(CaptainPlayer):
     
 
 class HumanCaptainPlayer(CaptainPlayer):
+    #number of nearest dictionary hints used for a hint that is not in the dictionary
+    NEIGHBOUR_HINTS = 5
+    
     def giveHint(self, board : Board, team : int) -> Hint:
         #if playing human + human, print a warning, so the agent doesn't see the board by mistake
         input("Press ENTER to show the board, with colored roles")
         #print current board
         print (f"Current board:")
         ConsoleRenderer.render(board, True)
-        #human will try giving a hint. If it is not present in the dictionary, he will try again
+        #human will try giving a hint. If it is not present in the dictionary, AI agents guess using the nearest dictionary hints by fast text embeddings
+        #if it has no embedding either, the player has to try again
+        dictionary = board.context.dictionary
         while True:
             hint = input ("The hint to give: ")
             hint_i = dictionary.hintWordI(hint)
             if hint_i is not None:
                 break
-            else:
-                print ("This word isn't in the dictionary - AI models cannot guess based on it, try another one. Sorry :(")
+            nearest = FastTextIndex.load(dictionary.language_settings).nearestHints(hint, dictionary, HumanCaptainPlayer.NEIGHBOUR_HINTS)
+            neighbours_hint = Hint.fromNeighbours(hint, 0, nearest, dictionary)
+            if neighbours_hint is not None:
+                print ("This word isn't in the dictionary, AI models will guess based on similar words: " + ", ".join(dictionary.hintWord(i) for i in neighbours_hint.neighbours[0]))
+                break
+            print ("This word isn't in the dictionary - AI models cannot guess based on it, try another one. Sorry :(")
         #human will try entering a number of words associated with this hint. If invalid, he will try again
         while True:
             try:
@@ -60,41 +71,49 @@ class HumanCaptainPlayer(CaptainPlayer):
             except ValueError:
                 print ("Given value must be an integer. Try again.")
         #return the given hint
-        return Hint(hint_i, count)
+        if hint_i is None:
+            neighbours_hint.count = count
+            return neighbours_hint
+        return Hint(hint_i, count, dictionary=dictionary)
 
 
 
 
 class AgentPlayer:
-    #play turn -  guess words associated with the given hint
-    def playTurn(self, board : Board, hint : Hint, team : int):
-        print (f"Current turn: {colored('Agent', team)}")
+    #play turn -  guess words associated with the given hint, return the revealed cards. If quiet, nothing is printed and the player does not wait for enter (used by simulations)
+    def playTurn(self, board : Board, hint : Hint, team : int, quiet = False):
+        if not quiet: print (f"Current turn: {colored('Agent', team)}")
         #make all the guesses
-        self.guess(board, hint, team)
-        #print the board after turn
-        print ("Board after turn:")
-        ConsoleRenderer.render(board, False)
-        press_enter_clear()
+        revealed = self.guess(board, hint, team, quiet)
+        if not quiet:
+            #print the board after turn
+            print ("Board after turn:")
+            ConsoleRenderer.render(board, False)
+            press_enter_clear()
+        return revealed
     
-    def guess(self, board : Board, hint : Hint, team : int):
+    def guess(self, board : Board, hint : Hint, team : int, quiet = False):
+        revealed = []
         #cycle over remaining hints count
         for rem_hints in range(hint.count + 1, 0, -1):
             #print given hint
-            print (f"Given hint: {hint.colored(team)}, Remaining guesses: {rem_hints - 1} + {1}")
+            if not quiet: print (f"Given hint: {hint.colored(team)}, Remaining guesses: {rem_hints - 1} + {1}")
             #guess one word (will be overriden by child classes)
             card_i = self.guessWord(board, hint, rem_hints)
             #if no card was guessed, stop guessing
             if card_i == None: break
             #else, reveal the given card
             role = board.reveal(card_i)
+            revealed.append(role)
             word = role.getStr(True)
             #print a message based on whether my guess was correct or not
             if role.role != team:
-                print (f"Guessed a wrong word ({word}). Your turn ends.")
+                if not quiet: print (f"Guessed a wrong word ({word}). Your turn ends.")
                 break
-            else:
+            elif not quiet:
                 print (f"Guessed correctly ({word})")
             if board.game_ended: break
+        return revealed
     
     #will be overriden by child classes
     def guessWord(self, board : Board, hint : Hint, remaining_guesses : int):
@@ -125,7 +144,7 @@ class HumanAgentPlayer(AgentPlayer):
         #if nothing was given, end turn
         if guess == "": return None
         #else, check whether the guess is valid (it must be on the board and in the dictionary). If yes, return it, if not, run this method again
-        word_i = dictionary.boardWordI(guess)
+        word_i = board.context.dictionary.boardWordI(guess)
         if word_i is not None and board.canGuess(word_i):
             return board.findWord(word_i)
         else:
@@ -134,9 +153,10 @@ class HumanAgentPlayer(AgentPlayer):
 
 
 class Team:
-    #play 1 turn - captain gives a hint and an agent guesses words based on it    
-    def playTurn(self, board : Board):
-        pass
+    #play 1 turn - captain gives a hint and an agent guesses words based on it. Returns the hint (None if no hint was given) and the list of revealed cards
+    #if quiet, nothing is printed and players do not wait for enter (used by simulations)
+    def playTurn(self, board : Board, quiet = False):
+        return None, []
     
     #set team color
     def setTeam(self, team):
@@ -151,21 +171,23 @@ class RealTeam(Team):
         self.captain = captain
         self.agent = agent
     
-    def playTurn(self, board : Board):
+    def playTurn(self, board : Board, quiet = False):
         #captain gives a hint
-        hint = self.captain.playTurn(board, self.team)
+        hint = self.captain.playTurn(board, self.team, quiet)
         #and agent guesses based on it
-        self.agent.playTurn(board, hint, self.team)
+        return hint, self.agent.playTurn(board, hint, self.team, quiet)
 
 #auto team - turn over one friendly card every turn
 class AutoTeam(Team):  
-    def playTurn(self, board : Board):
+    def playTurn(self, board : Board, quiet = False):
         #reveal a card
         card = board.revealCardOfColor(self.team)
-        #print the board to tell others what was revealed
-        print (f"Auto team plays, turning over {card.getStr(True)}. Current board:")
-        ConsoleRenderer.render(board, False)
-        press_enter_clear()
+        if not quiet:
+            #print the board to tell others what was revealed
+            print (f"Auto team plays, turning over {card.getStr(True)}. Current board:")
+            ConsoleRenderer.render(board, False)
+            press_enter_clear()
+        return None, [card]
 
 
 #holds two teams, can play a game with both of them
@@ -173,18 +195,19 @@ class Game:
     blue_team : Team
     red_team : Team
     
-    #save given teams and assign their colors
-    def __init__(self, blue_team, red_team):
+    #save given teams and assign their colors. Boards are created using the given context, or the current one if None
+    def __init__(self, blue_team, red_team, context : Context = None):
         blue_team.setTeam(BLUE)
         self.blue_team = blue_team
         red_team.setTeam(RED)
         self.red_team = red_team
+        self.context = context
         
     
     def playRound(self):
         #select a starting team, create the initial board accordingly
         blue_starts = random.random() < 0.5
-        board = Board.randomBoard(blue_starts)
+        board = Board.randomBoard(blue_starts, self.context)
         blue_play = blue_starts
         while True:
             #if blue should play, let blue play a turn. Else let red
@@ -211,13 +234,14 @@ class Game:
     TEAM_AI_H = 1
     TEAM_H_AI = 2
     TEAM_H_H = 3
+    TEAM_AI_AI = 4
     @staticmethod
     def createTeam(team_type, ai_initializer):
         #create a team based on the integers above
         if team_type == Game.TEAM_AUTO: return AutoTeam()
         return RealTeam(
-            AICaptainPlayer(CaptainModel(ai_initializer)) if team_type == Game.TEAM_AI_H else HumanCaptainPlayer(),
-            AIAgentPlayer(AgentModel(ai_initializer)) if team_type == Game.TEAM_H_AI else HumanAgentPlayer()
+            AICaptainPlayer(CaptainModel(ai_initializer)) if team_type in (Game.TEAM_AI_H, Game.TEAM_AI_AI) else HumanCaptainPlayer(),
+            AIAgentPlayer(AgentModel(ai_initializer)) if team_type in (Game.TEAM_H_AI, Game.TEAM_AI_AI) else HumanAgentPlayer()
         )
 
     #let user input values into the console to create a team as they wish
@@ -225,7 +249,7 @@ class Game:
     def createTeamInput(team_name, ai_initializer):
         print (f"Create {team_name} team:")
         #let user enter a team type
-        team_type = int(input(f"Define team type:\n * {Game.TEAM_AUTO} for AutoTeam\n * {Game.TEAM_AI_H} for AI+human\n * {Game.TEAM_H_AI} for human+AI\n * {Game.TEAM_H_H} for human+human\nTeam type:"))
+        team_type = int(input(f"Define team type:\n * {Game.TEAM_AUTO} for AutoTeam\n * {Game.TEAM_AI_H} for AI+human\n * {Game.TEAM_H_AI} for human+AI\n * {Game.TEAM_H_H} for human+human\n * {Game.TEAM_AI_AI} for AI+AI\nTeam type:"))
         #return the created team
         return Game.createTeam(int(team_type), ai_initializer)
     
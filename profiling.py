@@ -0,0 +1,118 @@
+import time
+import json
+import csv
+import contextlib
+import functools
+import numpy as np
+from typing import Dict, List
+
+
+#measures one phase - the time between entering and leaving it is added to the profiler
+class PhaseTimer:
+    def __init__(self, name : str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        Profiler.add(self.name, time.perf_counter() - self.start)
+        return False
+
+
+#opt-in wall time measurement of hot path phases (dictionary load, weights loading or computing, board creation, hints, guesses, rendering)
+#disabled by default - phase() then returns one shared empty context manager, so instrumented code costs just one function call
+class Profiler:
+    enabled = False
+    #durations of all calls of every phase, in seconds
+    durations : Dict[str, List[float]] = {}
+
+    _disabled_phase = contextlib.nullcontext()
+
+    #use as 'with Profiler.phase("name"):' around the measured code
+    @staticmethod
+    def phase(name : str):
+        return PhaseTimer(name) if Profiler.enabled else Profiler._disabled_phase
+
+    #decorator measuring every call of a function as the given phase. When disabled, the function is just called
+    @staticmethod
+    def timed(name : str):
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if not Profiler.enabled: return fn(*args, **kwargs)
+                with PhaseTimer(name):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    @staticmethod
+    def enable(enabled = True):
+        Profiler.enabled = enabled
+
+    @staticmethod
+    def reset():
+        Profiler.durations = {}
+
+    @staticmethod
+    def add(name : str, seconds : float):
+        Profiler.durations.setdefault(name, []).append(seconds)
+
+    #return all recorded durations and clear them - used to send measurements from worker processes
+    @staticmethod
+    def takeSnapshot():
+        snapshot, Profiler.durations = Profiler.durations, {}
+        return snapshot
+
+    #add durations recorded elsewhere (e.g. in another process)
+    @staticmethod
+    def merge(snapshot : Dict[str, List[float]]):
+        for name, seconds in snapshot.items():
+            Profiler.durations.setdefault(name, []).extend(seconds)
+
+    #upper bounds (inclusive) of histogram bins in seconds - logarithmic, from 1 us to 100 s, the last bin holds everything longer
+    HISTOGRAM_BINS = [10.0 ** e for e in range(-6, 3)]
+
+    #aggregated statistics of every phase - call count, total, mean, percentiles and a histogram of durations
+    @staticmethod
+    def summary():
+        result = {}
+        for name, seconds in sorted(Profiler.durations.items()):
+            s = np.array(seconds)
+            p50, p90, p99 = np.percentile(s, [50, 90, 99])
+            histogram = np.bincount(np.searchsorted(Profiler.HISTOGRAM_BINS, s), minlength=len(Profiler.HISTOGRAM_BINS) + 1)
+            result[name] = {"calls": len(s), "total": float(s.sum()), "mean": float(s.mean()), "min": float(s.min()), "p50": float(p50), "p90": float(p90), "p99": float(p99), "max": float(s.max()), "histogram": histogram.tolist()}
+        return result
+
+    #print the summary as a table, phases taking the most time first
+    @staticmethod
+    def report():
+        summary = Profiler.summary()
+        labels = [f"<={b*1e6:g}us" if b < 1e-3 else f"<={b*1e3:g}ms" if b < 1 else f"<={b:g}s" for b in Profiler.HISTOGRAM_BINS] + ["longer"]
+        print (f"{'phase':48} {'calls':>8} {'total s':>10} {'mean ms':>10} {'p50 ms':>10} {'p99 ms':>10} {'max ms':>10}")
+        for name, s in sorted(summary.items(), key=lambda x: -x[1]["total"]):
+            print (f"{name:48} {s['calls']:8} {s['total']:10.3f} {s['mean']*1e3:10.3f} {s['p50']*1e3:10.3f} {s['p99']*1e3:10.3f} {s['max']*1e3:10.3f}")
+            print ("    " + ", ".join(f"{l}: {c}" for l, c in zip(labels, s["histogram"]) if c > 0))
+
+    #save the summary as json
+    @staticmethod
+    def exportJson(fname : str):
+        with open(fname, "w") as f:
+            json.dump({"histogram_bins": Profiler.HISTOGRAM_BINS, "phases": Profiler.summary()}, f, indent=2)
+
+    #save the summary as csv, one row per phase, one column per statistic and histogram bin
+    @staticmethod
+    def exportCsv(fname : str):
+        summary = Profiler.summary()
+        stats = ["calls", "total", "mean", "min", "p50", "p90", "p99", "max"]
+        with open(fname, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["phase"] + stats + [f"le_{b:g}s" for b in Profiler.HISTOGRAM_BINS] + ["longer"])
+            for name, s in summary.items():
+                writer.writerow([name] + [s[k] for k in stats] + s["histogram"])
+
+
+
+if __name__ == "__main__":
+    import main
@@ -0,0 +1,100 @@
+from typing import List
+from common import *
+
+from board import Board
+from model import AgentModel, CaptainModel
+from datasets import ModelInitializer
+from players import Team, RealTeam, AutoTeam, AICaptainPlayer, AIAgentPlayer, Game
+
+
+#everything that happened in one simulated game
+class GameResult:
+    #BLUE or RED
+    winner : int
+    #number of turns played by both teams
+    turns : int
+    #list of (team, hint index, hint count) for every hint given
+    hints : list
+    #how many cards were revealed after each hint in the list above
+    revealed_per_hint : List[int]
+    #team that revealed the assassin, UNKNOWN if nobody did
+    assassin_team : int
+
+    def __init__(self):
+        self.winner = UNKNOWN
+        self.turns = 0
+        self.hints = []
+        self.revealed_per_hint = []
+        self.assassin_team = UNKNOWN
+
+    @property
+    def assassin_hit(self):
+        return self.assassin_team != UNKNOWN
+
+    @property
+    def hint_count(self):
+        return len(self.hints)
+
+
+#plays games between two AI or auto teams without any printing, rendering or waiting for input
+class Simulation:
+    blue_team : Team
+    red_team : Team
+
+    #boards are created using the given context, or the current one if None
+    def __init__(self, blue_team : Team, red_team : Team, context : Context = None):
+        blue_team.setTeam(BLUE)
+        self.blue_team = blue_team
+        red_team.setTeam(RED)
+        self.red_team = red_team
+        self.context = context
+
+    #play one turn of the given team, record what happened into result. Teams play the same way as in a game, just quietly
+    def playTurn(self, team : Team, board : Board, result : GameResult):
+        if not isinstance(team, AutoTeam) and (not isinstance(team, RealTeam) or not isinstance(team.captain, AICaptainPlayer) or not isinstance(team.agent, AIAgentPlayer)):
+            raise RuntimeError("Only AI players and auto teams can be simulated")
+        hint, revealed = team.playTurn(board, quiet=True)
+        if hint is None: return
+        if any(card.role == ASSASSIN for card in revealed): result.assassin_team = team.team
+        result.hints.append((team.team, int(hint.word_i), int(hint.count)))
+        result.revealed_per_hint.append(len(revealed))
+
+    #play one game, return its result. Same rules as Game.playRound
+    def playRound(self) -> GameResult:
+        result = GameResult()
+        blue_starts = random.random() < 0.5
+        board = Board.randomBoard(blue_starts, self.context)
+        blue_play = blue_starts
+        while True:
+            self.playTurn(self.blue_team if blue_play else self.red_team, board, result)
+            result.turns += 1
+            if board.blue_won or not blue_play and board.assassin_selected:
+                result.winner = BLUE
+                return result
+            if board.red_won or blue_play and board.assassin_selected:
+                result.winner = RED
+                return result
+            blue_play = not blue_play
+
+    #play n games, return a list of all results
+    def playGames(self, n : int) -> List[GameResult]:
+        return [self.playRound() for _ in range(n)]
+
+    #create a team based on Game team constants, using the given models. Only AI and auto teams can be simulated
+    @staticmethod
+    def createTeam(team_type, captain_model : CaptainModel, agent_model : AgentModel):
+        if team_type == Game.TEAM_AUTO: return AutoTeam()
+        if team_type == Game.TEAM_AI_AI: return RealTeam(AICaptainPlayer(captain_model), AIAgentPlayer(agent_model))
+        raise RuntimeError("Only AI+AI and auto teams can be simulated")
+
+    #create a simulation with given team types. Both teams share the same models, so weights are loaded only once. Models use weights of the given dtype
+    @staticmethod
+    def create(team1, team2, ai_initializer : ModelInitializer, context : Context = None, dtype = np.float64):
+        context = context if context is not None else Context.current()
+        captain_model, agent_model = CaptainModel(ai_initializer, dictionary=context.dictionary, dtype=dtype), AgentModel(ai_initializer, dictionary=context.dictionary, dtype=dtype)
+        return Simulation(Simulation.createTeam(team1, captain_model, agent_model), Simulation.createTeam(team2, captain_model, agent_model), context)
+
+
+
+if __name__ == "__main__":
+    import main
@@ -0,0 +1,120 @@
+import math
+import multiprocessing
+import tempfile
+from typing import List
+from common import *
+
+from datasets import ModelInitializer, ArrayInitializer
+from simulation import Simulation, GameResult
+
+
+#aggregated results of many games, from the point of view of the first (blue) team
+class TournamentStats:
+    games : int
+    wins : int
+    turns : int
+    assassin_hits : int
+
+    def __init__(self):
+        self.games = 0
+        self.wins = 0
+        self.turns = 0
+        self.assassin_hits = 0
+
+    #add the result of one game
+    def add(self, result : GameResult):
+        self.games += 1
+        self.wins += result.winner == BLUE
+        self.turns += result.turns
+        self.assassin_hits += result.assassin_hit
+
+    @property
+    def win_rate(self):
+        return self.wins / max(self.games, 1)
+
+    @property
+    def mean_turns(self):
+        return self.turns / max(self.games, 1)
+
+    #wilson score interval of the win rate, z=1.96 is the 95% confidence interval
+    def confidenceInterval(self, z = 1.96):
+        if self.games == 0: return 0.0, 1.0
+        n, p = self.games, self.win_rate
+        center = (p + z*z / (2*n)) / (1 + z*z / n)
+        half = z * math.sqrt(p * (1 - p) / n + z*z / (4*n*n)) / (1 + z*z / n)
+        return center - half, center + half
+
+    def __str__(self):
+        lo, hi = self.confidenceInterval()
+        return f"Games: {self.games}, win rate: {self.win_rate:.4f} (95% CI {lo:.4f} - {hi:.4f}), mean turns: {self.mean_turns:.2f}, assassin hits: {self.assassin_hits}"
+
+
+#simulation of the current worker process, created once by _initWorker
+_worker_simulation : typing.Optional[Simulation] = None
+
+#open the weights and the hint-major weights of agents as read-only memmaps - all workers share the same pages of the files, nothing is pickled or copied. Workers profile if the main process does
+#the context of the tournament is recreated from its settings and dictionary, so workers never fall back to the current context (which is not set in spawned processes)
+def _initWorker(weights_fname, hint_weights_fname, team1, team2, profile, game_settings, language_settings, dictionary):
+    global _worker_simulation
+    Profiler.enable(profile)
+    Profiler.reset()
+    weights = np.load(weights_fname, mmap_mode='r')
+    hint_weights = np.load(hint_weights_fname, mmap_mode='r')
+    context = Context(game_settings, language_settings, dictionary)
+    _worker_simulation = Simulation.create(team1, team2, ArrayInitializer(weights, hint_weights), context, dtype=weights.dtype)
+
+#play one chunk of games. Every chunk seeds its own random generators, so results do not depend on how chunks are distributed between workers
+#returns the results, and phase durations measured while playing them
+def _playChunk(task):
+    seed, count = task
+    random.seed(seed)
+    np.random.seed(seed)
+    return _worker_simulation.playGames(count), Profiler.takeSnapshot()
+
+
+#plays many games between two team types across a pool of processes
+class Tournament:
+    #models in all workers use weights of the given dtype. Games are played with the given context, the current one if None
+    def __init__(self, team1, team2, ai_initializer : ModelInitializer, processes : typing.Optional[int] = None, chunk_size : int = 50, seed : int = 0, dtype = np.float64, context : Context = None):
+        self.context = context if context is not None else Context.current()
+        self.team1 = team1
+        self.team2 = team2
+        self.ai_initializer = ai_initializer
+        self.processes = processes or os.cpu_count()
+        self.chunk_size = chunk_size
+        self.seed = seed
+        self.dtype = dtype
+
+    #play the given number of games, return aggregated stats. on_result is called for every game as results stream in
+    #if the profiler is enabled, phases measured in all workers are merged into it
+    def run(self, games : int, on_result = None) -> TournamentStats:
+        stats = TournamentStats()
+        #publish the weights and the hint-major weights as .npy files that every worker memory-maps. Cached weights are already memory mapped from such files, only other weights are saved to temporary ones
+        temporary = []
+        def publish(ws):
+            if isinstance(ws, np.memmap) and ws.flags.c_contiguous: return ws.filename
+            fd, fname = tempfile.mkstemp(suffix=".npy")
+            os.close(fd)
+            temporary.append(fname)
+            np.save(fname, np.ascontiguousarray(ws))
+            return fname
+        try:
+            dictionary = self.context.dictionary
+            weights_fname = publish(self.ai_initializer.getDenseWeights(dictionary, self.dtype))
+            hint_weights_fname = publish(self.ai_initializer.getDenseWeights(dictionary, self.dtype, hint_major=True))
+            tasks = [(self.seed + i, min(self.chunk_size, games - start)) for i, start in enumerate(range(0, games, self.chunk_size))]
+            worker_args = (weights_fname, hint_weights_fname, self.team1, self.team2, Profiler.enabled, self.context.game_settings, self.context.language_settings, dictionary)
+            with multiprocessing.Pool(self.processes, _initWorker, worker_args) as pool:
+                for results, profile in pool.imap_unordered(_playChunk, tasks):
+                    Profiler.merge(profile)
+                    for r in results:
+                        stats.add(r)
+                        if on_result is not None: on_result(r)
+        finally:
+            for fname in temporary: os.remove(fname)
+        return stats
+
+
+
+if __name__ == "__main__":
+    import main
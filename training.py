@@ -0,0 +1,148 @@
+import inspect
+from common import *
+
+from board import BoardBatch
+from model import CaptainModel, AgentModel
+from datasets import ModelInitializer, ArrayInitializer
+
+
+#trains captain weights by self-play. The captain gives a hint on many random boards at once, the agent guesses, and the weights between the hint and each guessed word are increased
+#(most for the first guess, less for every next one). All updates of a batch are applied at once, as a scatter-add over (board word, hint) pairs
+class Trainer:
+    #trained weights, they start as a copy of the initializer weights
+    weights : np.ndarray
+    #number of games played so far. A training game is not a whole game, but one hint on a random board (with some cards already revealed) and all guesses for it
+    games : int
+
+    #batch_size - games played at once, learning_rate - increase of the weight of the first guessed word, decay - every next guess increases the weight decay times less
+    #regularization - after every batch, all weights move this much back towards the initial ones, so that the captain cannot learn associations far from the data. It goes through
+    #all weights, so it is applied only every regularize_every batches, as much as all these batches together would
+    #partner - "base" if the agent guesses using the initial weights, "self" if it uses the trained ones. agent_random_chance - how often the agent guesses at random, based on the softmax of its weights
+    #max_revealed - up to this many random cards are revealed before the hint, so that boards from later turns are trained as well
+    def __init__(self, initializer : ModelInitializer, context : Context = None, batch_size = 256, learning_rate = 0.05, decay = 0.5, regularization = 1e-4, regularize_every = 16, partner = "base", agent_random_chance = 0.1, hint_mode = "topk", max_revealed = 8, seed = 0):
+        self.context = context if context is not None else Context.current()
+        dictionary = self.context.dictionary
+        self.base = initializer.getDenseWeights(dictionary)
+        self.weights = np.array(self.base)
+        self.batch_size = batch_size
+        self.learning_rate = learning_rate
+        self.decay = decay
+        self.regularization = regularization
+        self.regularize_every = regularize_every
+        self.partner = partner
+        self.max_revealed = max_revealed
+        self.seed = seed
+        #the captain uses the trained array directly - changes of the weights are visible to it right away. The agent reads hint-major weights, they are a separate contiguous copy
+        #(a transposed view would make every guess read its cards from different cache lines). When the agent uses the trained weights, the copy is updated together with them
+        self.captain = CaptainModel(ArrayInitializer(self.weights), hint_mode, dictionary=dictionary, incremental=False)
+        agent_weights = self.weights if partner == "self" else self.base
+        self.agent = AgentModel(ArrayInitializer(agent_weights, np.ascontiguousarray(agent_weights.T)), agent_random_chance, dictionary=dictionary)
+        self.games = 0
+        self.batches = 0
+
+    #reveal a random number of random cards on every board, the assassin is never revealed
+    def revealRandomCards(self, boards : BoardBatch):
+        order = np.argsort(np.where(boards.roles == ASSASSIN, np.inf, np.random.random(boards.hidden.shape)), 1)
+        revealed = np.arange(boards.size)[None, :] < np.random.randint(0, self.max_revealed + 1, [boards.batch_size, 1])
+        np.put_along_axis(boards.hidden, order, ~revealed, 1)
+
+    #play one batch of games and update the weights
+    def trainBatch(self):
+        #every batch has its own seed, so training gives the same results when resumed from a checkpoint
+        random.seed(self.seed + self.batches)
+        np.random.seed(self.seed + self.batches)
+        boards = BoardBatch.randomBoards(np.random.random(self.batch_size) < 0.5, self.context)
+        self.revealRandomCards(boards)
+        teams = np.where(np.random.random(self.batch_size) < 0.5, BLUE, RED)
+        hints = self.captain.giveHints(teams, boards)
+        counts = np.array([h.count for h in hints])
+        hint_idx = np.array([h.word_i for h in hints])
+
+        #the agent guesses one card on all active boards at once. A board stays active while the agent guesses cards of its team and the hint count was not reached
+        rows, cols, steps = [], [], []
+        active = np.ones(self.batch_size, dtype=bool)
+        for step in range(counts.max()):
+            active &= counts > step
+            boards_i = np.flatnonzero(active)
+            if len(boards_i) == 0: break
+            active_boards = BoardBatch(boards.word_idx[boards_i], boards.roles[boards_i], boards.hidden[boards_i], boards.disabled_hints[boards_i], self.context)
+            guesses = self.agent.guess(active_boards, [hints[i] for i in boards_i])
+            boards.hidden[boards_i, guesses] = False
+            rows.append(boards.word_idx[boards_i, guesses])
+            cols.append(hint_idx[boards_i])
+            steps.append(np.full(len(boards_i), step))
+            active[boards_i] &= boards.roles[boards_i, guesses] == teams[boards_i]
+
+        #increase weights of all guessed words for their hints at once, duplicate pairs are summed. Weights stay at most 1, like the initial ones
+        rows, cols = np.concatenate(rows), np.concatenate(cols)
+        np.add.at(self.weights, (rows, cols), self.learning_rate * self.decay ** np.concatenate(steps))
+        self.weights[rows, cols] = np.minimum(self.weights[rows, cols], 1.0)
+        if self.partner == "self": self.agent.hint_weights[cols, rows] = self.weights[rows, cols]
+        self.games += self.batch_size
+        self.batches += 1
+        if self.regularization > 0 and self.batches % self.regularize_every == 0:
+            #weights - base shrink by (1 - regularization) every batch. In place, without temporary arrays of the size of the weights
+            self.weights -= self.base
+            self.weights *= (1 - self.regularization) ** self.regularize_every
+            self.weights += self.base
+            if self.partner == "self": np.copyto(self.agent.hint_weights, self.weights.T)
+
+    #train until the given number of games was played. If checkpoint_fname is given, the state is saved into it every checkpoint_every games
+    def train(self, games : int, checkpoint_fname : typing.Optional[str] = None, checkpoint_every = 100000, on_progress = None):
+        last_checkpoint = self.games
+        while self.games < games:
+            self.trainBatch()
+            if on_progress is not None: on_progress(self.games)
+            if checkpoint_fname is not None and self.games - last_checkpoint >= checkpoint_every:
+                self.saveCheckpoint(checkpoint_fname)
+                last_checkpoint = self.games
+        return self.weights
+
+    def saveCheckpoint(self, fname : str):
+        utils.atomic_write(fname, lambda f: np.savez(f, weights=self.weights, games=self.games, batches=self.batches))
+
+    def loadCheckpoint(self, fname : str):
+        with np.load(fname) as checkpoint:
+            self.weights[...] = checkpoint["weights"]
+            self.games = int(checkpoint["games"])
+            self.batches = int(checkpoint["batches"])
+        if self.partner == "self": np.copyto(self.agent.hint_weights, self.weights.T)
+
+
+#weights trained by self-play, starting from the weights of another initializer. Unfinished training is checkpointed next to the cached weights, and continues from there when computed again
+class TrainedInitializer(ModelInitializer):
+    def __init__(self, initializer : ModelInitializer, games = 100000, fname = "trained", checkpoint_every = 10000, **trainer_params):
+        self.weights_filename = fname
+        self.initializer = initializer
+        self.games = games
+        self.checkpoint_every = checkpoint_every
+        #all other parameters of the Trainer
+        self.trainer_params = dict(sorted(trainer_params.items()))
+
+    def dependencies(self, dictionary : Dictionary):
+        return [(self.initializer, dictionary)]
+
+    #how often checkpoints are saved does not change the result. Default values of the trainer parameters are included, so that weights trained with older defaults are not reused
+    def cacheParams(self):
+        params = {k: v for k, v in super().cacheParams().items() if k != "checkpoint_every"}
+        defaults = {k: p.default for k, p in inspect.signature(Trainer.__init__).parameters.items() if p.default is not inspect.Parameter.empty and k != "context"}
+        params["trainer_params"] = dict(sorted({**defaults, **self.trainer_params}.items()))
+        return params
+
+    def computeWeights(self, dictionary : Dictionary):
+        trainer = Trainer(self.initializer, Context(language_settings=dictionary.language_settings, dictionary=dictionary), **self.trainer_params)
+        checkpoint_fname = os.path.splitext(self.cacheFilename(dictionary))[0] + "_checkpoint.npz"
+        if utils.file_exists(checkpoint_fname): trainer.loadCheckpoint(checkpoint_fname)
+        weights = trainer.train(self.games, checkpoint_fname, self.checkpoint_every)
+        #the finished weights are cached by getWeights, the checkpoint is not needed anymore
+        if utils.file_exists(checkpoint_fname): os.remove(checkpoint_fname)
+        return weights
+
+    #trained weights are kept in the range of the initial ones
+    def transformWeights(self, weights):
+        return weights
+
+
+
+if __name__ == "__main__":
+    import main